@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Answers file for unattended os_initialization
+#
+# {
+#     "defaults": { "timezone": "America/Los_Angeles", "ssh_keys": ["admin"], "disable_selinux": true,
+#                   "install_packages": true },
+#     "groups":   { "rack1": { "hosts": ["10.1.0.11", "10.1.0.12"], "timezone": "Asia/Shanghai" } },
+#     "hosts":    { "10.1.0.11": { "hostname": "node11" } }
+# }
+#
+# Values are merged as GlobalConfig "answers" < file defaults < group < host.
+# A missing hostname or timezone keeps the detected value. Hosts are written
+# like in the inventory, "[user@]host[:port]"; without a port an entry applies
+# to the host on every port, an entry with the port wins over it.
+
+import  os
+import  re
+import  json
+
+from    global_config                   import GlobalConfig
+from    timezones                       import is_valid_timezone
+from    fleet                           import parse_host
+
+ANSWER_KEYS = ["hostname", "timezone", "ssh_keys", "disable_selinux", "install_packages", "dnf_speed"]
+
+HOSTNAME_RE = re.compile(r"^(?=.{1,253}$)[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*$")
+
+class AnswersError(ValueError):
+    pass
+
+def host_address(host, port=None):
+    # "host" or "host:port", how the answers name an inventory host
+    return host if port is None else f"{host}:{port}"
+
+def host_matches(spec, host, port=None):
+    # True if the "[user@]host[:port]" entry of the file names the host
+    name, spec_port, _ = parse_host(str(spec))
+    return name == host and (spec_port is None or spec_port == (port or 22))
+
+def load_answers_file(path):
+    path = os.path.expanduser(path)
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise AnswersError("PyYAML is required to read YAML answers files (pip install pyyaml)")
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+
+    if not isinstance(data, dict):
+        raise AnswersError(f"{path}: the answers file must contain a mapping")
+    return data
+
+class Answers:
+    def __init__(self, data):
+        self.data = data
+
+    @classmethod
+    def load(cls, path):
+        return cls(load_answers_file(path))
+
+    def resolve(self, host, port=None):
+        # Merge all layers that apply to the given inventory host
+        answers = {"disable_selinux": True, "install_packages": False, "dnf_speed": False, "ssh_keys": []}
+        answers.update(GlobalConfig().get("answers", {}) or {})
+        answers.update(self.data.get("defaults", {}) or {})
+        for group in (self.data.get("groups", {}) or {}).values():
+            if any(host_matches(spec, host, port) for spec in group.get("hosts", [])):
+                answers.update({k: v for k, v in group.items() if k != "hosts"})
+        entries = [(spec, values) for spec, values in (self.data.get("hosts", {}) or {}).items()
+                   if host_matches(spec, host, port)]
+        # entries naming the port last, so they win
+        for spec, values in sorted(entries, key=lambda entry: parse_host(str(entry[0]))[1] is not None):
+            answers.update(values or {})
+        return answers
+
+    def hosts(self):
+        # All hosts named in the file, in order of appearance
+        hosts = list((self.data.get("hosts", {}) or {}).keys())
+        for group in (self.data.get("groups", {}) or {}).values():
+            hosts += group.get("hosts", [])
+        return list(dict.fromkeys(hosts))
+
+    def validate(self, hosts):
+        # Resolve and check the answers of every (host, port) up front, raising
+        # one AnswersError listing all problems; returns the answers by (host, port)
+        keys = GlobalConfig().get("ssh_keys") or {}
+        errors   = []
+        resolved = {}
+        for address in hosts:
+            answers = self.resolve(*address)
+            host = host_address(*address)
+            for name in answers:
+                if name not in ANSWER_KEYS:
+                    errors.append(f"{host}: unknown setting '{name}'")
+
+            hostname = answers.get("hostname")
+            if hostname is not None and not HOSTNAME_RE.match(str(hostname)):
+                errors.append(f"{host}: invalid hostname '{hostname}'")
+
+            timezone = answers.get("timezone")
+            if timezone is not None and not is_valid_timezone(timezone):
+                errors.append(f"{host}: invalid timezone '{timezone}'")
+
+            ssh_keys = answers.get("ssh_keys")
+            if not isinstance(ssh_keys, list):
+                errors.append(f"{host}: ssh_keys must be a list of key names")
+            else:
+                for key_name in ssh_keys:
+                    if key_name not in keys:
+                        errors.append(f"{host}: unknown ssh key '{key_name}'")
+
+            for name in ("disable_selinux", "install_packages", "dnf_speed"):
+                if not isinstance(answers.get(name), bool):
+                    errors.append(f"{host}: {name} must be true or false")
+
+            resolved[address] = answers
+
+        if errors:
+            raise AnswersError("Invalid answers:\n" + "\n".join(f"   - {error}" for error in errors))
+        return resolved
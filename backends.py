@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# OS backend registry: detected OS strings map to a backend class that is
+# imported only when a host running that OS is found
+
+import  importlib
+
+os_supported = {
+    "rhel": {
+        "versions": ["CentOS Linux 7", "CentOS Linux 8", "Oracle Linux 8", "Oracle Linux 9", "Rocky Linux 8", "Rocky Linux 9"],
+        "backend":  ("redhat", "RedhatServer"),
+    },
+    "ubuntu": {
+        "versions": ["Ubuntu 18", "Ubuntu 20", "Ubuntu 22", "Ubuntu 24"],
+        "backend":  None,
+    },
+}
+
+def register_backend(family, versions, module_name, class_name):
+    os_supported[family] = {"versions": list(versions), "backend": (module_name, class_name)}
+
+def find_backend(os_detected):
+    # Return the backend class for the detected OS, None if it is not supported
+    for family in os_supported.values():
+        if os_detected in family["versions"] and family["backend"]:
+            module_name, class_name = family["backend"]
+            return getattr(importlib.import_module(module_name), class_name)
+    return None
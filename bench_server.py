@@ -0,0 +1,518 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# SSH stand-in server for benchmarks. Commands run in a local bash
+# inside a scratch directory that plays the role of the remote root file
+# system, with fake rpm, yum, hostnamectl, timedatectl, getenforce and curl
+# commands keeping their state in files. "sudo -i" is emulated on shell channels.
+# Runs in-process, or as its own process with "python bench_server.py '<options>'"
+# so that benchmark.py measures only the client (see serve()).
+
+import  os
+import  re
+import  sys
+import  json
+import  shutil
+import  signal
+import  socket
+import  tempfile
+import  threading
+import  subprocess
+import  time
+
+import  paramiko
+
+FAKE_COMMANDS = {
+"sudo": r'''#!/bin/sh
+exec "$@"
+''',
+"rpm": r'''#!/bin/sh
+db="$FAKE_STATE/packages"
+if [ "$1" = "-qa" ]; then cat "$db"; exit 0; fi
+shift
+marker=""
+quiet=""
+if [ "$1" = "--qf" ]; then marker=1; shift 2; fi
+if [ "$1" = "--quiet" ]; then quiet=1; shift; fi
+rc=0
+for p in "$@"; do
+    if grep -qx -- "$p" "$db"; then
+        if [ -n "$quiet" ]; then :; elif [ -n "$marker" ]; then echo "@@ $p"; else echo "$p-1.0-1.el9.x86_64"; fi
+    else
+        [ -n "$quiet" ] || echo "package $p is not installed"; rc=1
+    fi
+done
+exit $rc
+''',
+"yum": r'''#!/bin/sh
+# fake yum: prints FAKE_YUM_LINES lines per transaction, FAKE_OUTPUT_RATE lines/s (0 = unlimited)
+emit() {
+    lines=$1
+    rate=${FAKE_OUTPUT_RATE:-0}
+    if [ "$rate" -le 0 ]; then
+        yes "  Downloading : fake-package-1.0-1.el9.x86_64.rpm     1.2 MB/s | 300 kB  00:00" | head -n "$lines"
+        return
+    fi
+    chunk=$(( rate / 10 )); [ "$chunk" -lt 1 ] && chunk=1
+    while [ "$lines" -gt 0 ]; do
+        n=$chunk; [ "$n" -gt "$lines" ] && n=$lines
+        yes "  Downloading : fake-package-1.0-1.el9.x86_64.rpm     1.2 MB/s | 300 kB  00:00" | head -n "$n"
+        lines=$(( lines - n ))
+        sleep 0.1
+    done
+}
+while [ $# -gt 0 ]; do
+    case "$1" in
+        -y|-q|--assumeyes) shift ;;
+        --setopt=*) shift ;;
+        *) break ;;
+    esac
+done
+action=$1; shift
+case "$action" in
+    install)
+        emit "${FAKE_YUM_LINES:-200}"
+        for p in "$@"; do
+            case "$p" in -*) continue ;; esac
+            grep -qx -- "$p" "$FAKE_STATE/packages" || echo "$p" >> "$FAKE_STATE/packages"
+        done
+        echo "Complete!" ;;
+    update|upgrade)
+        emit "${FAKE_YUM_LINES:-200}"
+        echo "Complete!" ;;
+    *)
+        echo "ok" ;;
+esac
+''',
+"hostname": r'''#!/bin/sh
+cat "$FAKE_STATE/hostname"
+''',
+"hostnamectl": r'''#!/bin/sh
+[ "$1" = "set-hostname" ] && echo "$2" > "$FAKE_STATE/hostname"
+exit 0
+''',
+"timedatectl": r'''#!/bin/sh
+case "$1" in
+    set-timezone) echo "$2" > "$FAKE_STATE/timezone" ;;
+    set-ntp)      echo "$2" > "$FAKE_STATE/ntp" ;;
+    *)
+        echo "      Time zone: $(cat "$FAKE_STATE/timezone") (UTC, +0000)"
+        if [ "$(cat "$FAKE_STATE/ntp")" = "true" ]; then echo "    NTP enabled: yes"; else echo "    NTP enabled: no"; fi ;;
+esac
+''',
+"getenforce": r'''#!/bin/sh
+cat "$FAKE_STATE/selinux"
+''',
+"setenforce": r'''#!/bin/sh
+[ "$(cat "$FAKE_STATE/selinux")" = "Disabled" ] && exit 1
+[ "$1" = "0" ] && echo Permissive > "$FAKE_STATE/selinux"
+exit 0
+''',
+"curl": r'''#!/bin/sh
+echo "<html><head><title>Current IP Check</title></head><body>Current IP Address: 203.0.113.7</body></html>"
+''',
+"id": r'''#!/bin/sh
+# the stand-in host is always entered as root
+[ "$1" = "-u" ] && echo 0 && exit 0
+exec /usr/bin/id "$@"
+''',
+"getent": r'''#!/bin/sh
+# "getent passwd user": every user lives in the scratch home
+[ "$1" = "passwd" ] && echo "$2:x:0:0:$2:$HOME:/bin/bash"
+''',
+"ssh-keygen": r'''#!/bin/sh
+# "ssh-keygen -lf file": a fingerprint-like line per key
+[ -f "$2" ] && awk '/^(ssh-|ecdsa-|sk-)/ { print "256 SHA256:" substr($2, 1, 43) " " $3 " (FAKE)" }' "$2"
+exit 0
+''',
+}
+
+SSHD_CONFIG = """#Port 22
+PermitRootLogin yes
+#UseDNS yes
+Subsystem sftp /usr/libexec/openssh/sftp-server
+"""
+
+DNF_CONFIG = """[main]
+gpgcheck=1
+installonly_limit=3
+clean_requirements_on_remove=True
+best=True
+skip_if_unavailable=False
+"""
+
+SELINUX_CONFIG = """SELINUX=enforcing
+SELINUXTYPE=targeted
+"""
+
+class FakeHost:
+    # latency:      seconds added before every exec, shell line and SFTP session
+    # yum_lines:    lines printed by every yum transaction
+    # output_rate:  yum output lines per second, 0 for unlimited
+    # exit_codes:   {regex: exit code} for commands that should fail
+    def __init__(self, latency=0.0, yum_lines=200, output_rate=0, exit_codes=None,
+                 packages=None, os_name="Rocky Linux 9.4 (Blue Onyx)", sudo_password=None):
+        self.latency       = latency
+        self.yum_lines     = yum_lines
+        self.output_rate   = output_rate
+        self.exit_codes    = [(re.compile(pattern), code) for pattern, code in (exit_codes or {}).items()]
+        self.sudo_password = sudo_password
+        self.counters      = {"exec": 0, "shell": 0, "shell_lines": 0, "sftp_sessions": 0, "sftp_ops": 0,
+                              "hangups": 0}
+        self.lock          = threading.Lock()
+
+        self.dir   = tempfile.mkdtemp(prefix="linuxsetup-bench-")
+        self.root  = os.path.join(self.dir, "root")
+        self.home  = os.path.join(self.root, "root")
+        self.state = os.path.join(self.dir, "state")
+        self.bin   = os.path.join(self.dir, "bin")
+        for path in (self.home, self.state, self.bin,
+                     os.path.join(self.root, "etc/ssh"), os.path.join(self.root, "etc/selinux"),
+                     os.path.join(self.root, "etc/dnf")):
+            os.makedirs(path, exist_ok=True)
+
+        for name, script in FAKE_COMMANDS.items():
+            path = os.path.join(self.bin, name)
+            with open(path, "w") as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+
+        files = {
+            "etc/os-release":       f'NAME="Rocky Linux"\nPRETTY_NAME="{os_name}"\n',
+            "etc/ssh/sshd_config":  SSHD_CONFIG,
+            "etc/selinux/config":   SELINUX_CONFIG,
+            "etc/dnf/dnf.conf":     DNF_CONFIG,
+        }
+        for path, content in files.items():
+            with open(os.path.join(self.root, path), "w") as f:
+                f.write(content)
+        os.chmod(os.path.join(self.root, "etc/ssh/sshd_config"), 0o600)
+
+        state = {
+            "packages": "\n".join(packages if packages is not None else ["bash", "coreutils", "openssh-server"]) + "\n",
+            "hostname": "localhost.localdomain\n",
+            "timezone": "America/New_York\n",
+            "ntp":      "false\n",
+            "selinux":  "Enforcing\n",
+        }
+        for name, content in state.items():
+            with open(os.path.join(self.state, name), "w") as f:
+                f.write(content)
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def rewrite(self, command):
+        # Map the remote /etc and /root into the scratch root file system
+        return re.sub(r"(?<![\w./-])/(etc|root)(?=/|\b)", lambda m: os.path.join(self.root, m.group(1)), command)
+
+    def env(self):
+        return {
+            "PATH":             f"{self.bin}:/usr/bin:/bin",
+            "HOME":             self.home,
+            "FAKE_STATE":       self.state,
+            "FAKE_YUM_LINES":   str(self.yum_lines),
+            "FAKE_OUTPUT_RATE": str(self.output_rate),
+            "LANG":             "C.UTF-8",
+        }
+
+    def exit_code_for(self, command):
+        for pattern, code in self.exit_codes:
+            if pattern.search(command):
+                return code
+        return None
+
+    def run(self, channel, command, pty):
+        self.count("exec")
+        if self.latency:
+            time.sleep(self.latency)
+
+        code = self.exit_code_for(command)
+        if code is not None:
+            channel.send_exit_status(code)
+            channel.close()
+            return
+
+        process = subprocess.Popen(["/bin/bash", "-c", self.rewrite(command)], cwd=self.home, env=self.env(),
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT if pty else subprocess.PIPE,
+                                   start_new_session=pty)
+
+        # a script fed to "sh -s" needs the same path mapping as a command line
+        script = command.endswith("sh -s")
+
+        def forward_stdin():
+            try:
+                buffered = bytearray()
+                while True:
+                    data = channel.recv(32768)
+                    if not data:
+                        break
+                    if script:
+                        buffered += data
+                        continue
+                    process.stdin.write(data)
+                    process.stdin.flush()
+                if script:
+                    process.stdin.write(self.rewrite(buffered.decode('utf-8')).encode('utf-8'))
+            except (OSError, EOFError):
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+
+        def forward_stderr():
+            for data in iter(lambda: process.stderr.read1(32768), b""):
+                channel.sendall_stderr(data)
+
+        def hangup():
+            # like sshd closing the terminal: SIGHUP to the session once the client closes
+            while process.poll() is None:
+                if channel.closed:
+                    self.count("hangups")
+                    os.killpg(process.pid, signal.SIGHUP)
+                    return
+                time.sleep(0.05)
+
+        threads = [threading.Thread(target=forward_stdin, daemon=True)]
+        if not pty:
+            threads.append(threading.Thread(target=forward_stderr, daemon=True))
+        else:
+            threading.Thread(target=hangup, daemon=True).start()
+        for thread in threads:
+            thread.start()
+
+        try:
+            for data in iter(lambda: process.stdout.read1(32768), b""):
+                channel.sendall(data)
+        except (OSError, EOFError):
+            pass
+        if not pty:
+            threads[1].join()
+        status = process.wait()
+        # killed by a signal: the shell convention, 128 + signal number
+        channel.send_exit_status(status if status >= 0 else 128 - status)
+        channel.close()
+
+    def shell(self, channel):
+        # Line based shell that understands "sudo -i"
+        self.count("shell")
+        prompt = "[bench@standin ~]$ "
+        channel.sendall(prompt.encode())
+        buffer = b""
+        try:
+            while True:
+                data = channel.recv(1024)
+                if not data:
+                    break
+                buffer += data
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    line = line.decode().strip()
+                    if line:
+                        # one round trip per line, but no channel setup
+                        self.count("shell_lines")
+                        if self.latency:
+                            time.sleep(self.latency)
+                    if line == "sudo -i":
+                        if self.sudo_password:
+                            channel.sendall(b"[sudo] password for bench: ")
+                            while b"\n" not in buffer:
+                                buffer += channel.recv(1024)
+                            _, buffer = buffer.split(b"\n", 1)
+                        prompt = "[root@standin ~]# "
+                    elif line:
+                        result = subprocess.run(["/bin/bash", "-c", self.rewrite(line)], cwd=self.home, env=self.env(),
+                                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                        channel.sendall(result.stdout)
+                    channel.sendall(prompt.encode())
+        except (OSError, EOFError):
+            pass
+        channel.close()
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+class StandInServer(paramiko.ServerInterface):
+    def __init__(self, host):
+        self.host = host
+        self.ptys = set()
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        self.ptys.add(channel.get_id())
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        # channel ids are reused, the pty request only applies to this channel
+        pty = channel.get_id() in self.ptys
+        self.ptys.discard(channel.get_id())
+        threading.Thread(target=self.host.run, args=(channel, command.decode(), pty), daemon=True).start()
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.ptys.discard(channel.get_id())
+        threading.Thread(target=self.host.shell, args=(channel,), daemon=True).start()
+        return True
+
+class StandInSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+class StandInSFTP(paramiko.SFTPServerInterface):
+    # SFTP rooted at the fake host's scratch root file system
+    def __init__(self, server, host, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.host = host
+        host.count("sftp_sessions")
+        if host.latency:
+            time.sleep(host.latency)
+
+    def _path(self, path):
+        self.host.count("sftp_ops")
+        if not path.startswith("/"):
+            path = "/root/" + path
+        return os.path.join(self.host.root, os.path.normpath(path).lstrip("/"))
+
+    def _errno(self, e):
+        return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def canonicalize(self, path):
+        if not path.startswith("/"):
+            path = "/root/" + path
+        return os.path.normpath(path)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return self._errno(e)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        path = self._path(path)
+        try:
+            mode = getattr(attr, "st_mode", None) or 0o666
+            fd = os.open(path, flags, mode)
+        except OSError as e:
+            return self._errno(e)
+        if flags & os.O_WRONLY:
+            fstr = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            fstr = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            fstr = "rb"
+        handle = StandInSFTPHandle(flags)
+        handle.filename  = path
+        handle.readfile  = os.fdopen(fd, fstr)
+        handle.writefile = handle.readfile
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            return self._errno(e)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.replace(self._path(oldpath), self._path(newpath))
+        except OSError as e:
+            return self._errno(e)
+        return paramiko.SFTP_OK
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._path(path))
+        except OSError as e:
+            return self._errno(e)
+        return paramiko.SFTP_OK
+
+    def list_folder(self, path):
+        path = self._path(path)
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return self._errno(e)
+
+class StandInSSHServer:
+    # Listens on 127.0.0.1 and serves every connection with the same FakeHost
+    def __init__(self, host):
+        self.host     = host
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock     = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port       = self.sock.getsockname()[1]
+        self.transports = []
+        self.running    = True
+        self.thread     = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _serve(self):
+        while self.running:
+            try:
+                client, address = self.sock.accept()
+            except OSError:
+                break
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            # like sshd, offer compression to clients that ask for it
+            transport.use_compression(True)
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, StandInSFTP, self.host)
+            transport.start_server(server=StandInServer(self.host))
+            self.transports.append(transport)
+
+    def stop(self):
+        self.running = False
+        self.sock.close()
+        for transport in self.transports:
+            transport.close()
+        self.host.cleanup()
+
+def serve(options):
+    # Serve one FakeHost built from options until stdin is closed. The port and
+    # the scratch directories are printed as one JSON line, after that every
+    # "counters" line on stdin is answered with the counters and "reset" zeroes them.
+    server = StandInSSHServer(FakeHost(**options))
+    print(json.dumps({"port": server.port, "root": server.host.root,
+                      "home": server.host.home, "state": server.host.state}), flush=True)
+    try:
+        for line in sys.stdin:
+            command = line.strip()
+            with server.host.lock:
+                if command == "reset":
+                    for key in server.host.counters:
+                        server.host.counters[key] = 0
+                print(json.dumps(server.host.counters), flush=True)
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    serve(json.loads(sys.argv[1]) if len(sys.argv) > 1 else {})
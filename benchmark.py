@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Benchmarks against the SSH stand-in server (bench_server.py), run as a separate
+# process so that CPU time and peak memory cover only the client side.
+# Every scenario reports round trips, wall time, CPU time and peak memory;
+# results are written as JSON so runs can be compared across commits.
+#
+#   python benchmark.py                       run all scenarios
+#   python benchmark.py -s full_init -l 0.05  one scenario with 50 ms latency
+#   python benchmark.py --compare old.json    show the change against an earlier run
+
+import  os
+import  sys
+import  json
+import  time
+import  base64
+import  argparse
+import  tempfile
+import  platform
+import  tracemalloc
+import  contextlib
+import  subprocess
+
+from    types                           import SimpleNamespace
+
+from    global_config                   import GlobalConfig, DEFAULT_CONFIG_ROOT
+
+DEFAULT_RESULTS_PATH = os.path.join(DEFAULT_CONFIG_ROOT, "bench")
+
+def setup_config():
+    # Keep keys, facts, journals and traces of the benchmark out of the user's config
+    scratch = tempfile.mkdtemp(prefix="linuxsetup-bench-config-")
+    global_config = GlobalConfig(os.path.join(scratch, "cfg/config.json"))
+    with global_config.batch():
+        global_config.set("log path", os.path.join(scratch, "log"))
+        global_config.set("facts path", os.path.join(scratch, "facts"))
+        global_config.set("facts ttl", 0)
+        global_config.set("history path", os.path.join(scratch, "history.db"))
+        global_config.set("geolocation online", False)
+        global_config.set("geolocation cache", "")
+        for index in range(5):
+            key = base64.b64encode(b"\x00\x00\x00\x0bssh-ed25519\x00\x00\x00\x20" + os.urandom(32)).decode()
+            global_config.set(f"ssh_keys bench{index} type", "ssh-ed25519")
+            global_config.set(f"ssh_keys bench{index} key", key)
+    return global_config
+
+class StandInProcess:
+    # bench_server.py running in a child process; host has the scratch root,
+    # home and state directories of the stand-in like FakeHost
+    def __init__(self, **options):
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_server.py")
+        self.process = subprocess.Popen([sys.executable, script, json.dumps(options)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        info = self._reply()
+        self.port = info["port"]
+        self.host = SimpleNamespace(root=info["root"], home=info["home"], state=info["state"])
+
+    def _reply(self):
+        line = self.process.stdout.readline()
+        if not line:
+            self.process.wait()
+            raise RuntimeError(f"bench_server.py exited with code {self.process.returncode}")
+        return json.loads(line)
+
+    def _request(self, command):
+        self.process.stdin.write(command + "\n")
+        self.process.stdin.flush()
+        return self._reply()
+
+    def counters(self):
+        return self._request("counters")
+
+    def reset_counters(self):
+        self._request("reset")
+
+    def stop(self):
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+def connect(server):
+    from connection import get_connection
+    return get_connection("127.0.0.1", server.port, "root", "bench")
+
+def scenario_yum_update(server):
+    # Stream a large yum update through the progress parser
+    from redhat import RedhatServer
+    RedhatServer(connect(server), "Rocky Linux 9").run_yum("sudo yum update -y")
+
+def scenario_package_checks(server):
+    # 50 package checks where everything is installed already
+    from redhat import RedhatServer
+    packages = [f"bench-package-{index}" for index in range(50)]
+    with open(os.path.join(server.host.state, "packages"), "a") as f:
+        f.write("\n".join(packages) + "\n")
+    RedhatServer(connect(server), "Rocky Linux 9").install_packages(packages)
+
+def scenario_key_merge(server):
+    # Merge 5 keys into an authorized_keys file that already holds 2 of them
+    from redhat import RedhatServer
+    from steps  import apply_steps
+    keys = GlobalConfig().get("ssh_keys")
+    os.makedirs(os.path.join(server.host.home, ".ssh"), exist_ok=True)
+    with open(os.path.join(server.host.home, ".ssh/authorized_keys"), "w") as f:
+        for key_name in ["bench0", "bench1"]:
+            f.write(f"{keys[key_name]['type']} {keys[key_name]['key']} {key_name}\n")
+    redhat = RedhatServer(connect(server), "Rocky Linux 9")
+    apply_steps([redhat.ssh_keys_step(sorted(keys))])
+
+def scenario_full_init(server, script=False):
+    # Connect, detect, install the default packages and apply all settings
+    from get_server import get_server
+    from redhat     import DEFAULT_PACKAGES
+    redhat = get_server("127.0.0.1", server.port, "root", "bench", interactive=False)
+    redhat.script_mode = script
+    redhat.install_packages(DEFAULT_PACKAGES)
+    redhat.os_initialization({
+        "hostname":         "bench01",
+        "timezone":         "UTC",
+        "ssh_keys":         sorted(GlobalConfig().get("ssh_keys")),
+        "disable_selinux":  True,
+    })
+
+def scenario_full_init_script(server):
+    # The same, with the settings applied as one compiled script
+    scenario_full_init(server, script=True)
+
+SCENARIOS = {
+    "yum_update":       (scenario_yum_update,       {"yum_lines": 200000}),
+    "package_checks":   (scenario_package_checks,   {}),
+    "key_merge":        (scenario_key_merge,        {}),
+    "full_init":        (scenario_full_init,        {}),
+    "full_init_script": (scenario_full_init_script, {}),
+}
+
+def run_scenario(name, latency=0.0):
+    func, options = SCENARIOS[name]
+    server = StandInProcess(latency=latency, **options)
+    try:
+        # connect outside the measurement, every scenario starts with a warm transport
+        connection = connect(server)
+        server.reset_counters()
+
+        tracemalloc.start()
+        wall_start = time.perf_counter()
+        cpu_start  = time.process_time()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            func(server)
+        wall = time.perf_counter() - wall_start
+        cpu  = time.process_time() - cpu_start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        counters = server.counters()
+        connection.close()
+    finally:
+        server.stop()
+
+    return {
+        "wall":         round(wall, 4),
+        "cpu":          round(cpu, 4),
+        "peak_memory":  peak,
+        "round_trips":  counters["exec"] + counters["shell"] + counters["shell_lines"] + counters["sftp_sessions"],
+        **counters,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results, baseline=None):
+    print(f"\n o Benchmark results ({results['commit'] or 'unknown commit'}, latency {results['latency'] * 1000:.0f} ms)")
+    print(f"   {'Scenario':<16} {'Round trips':>11} {'Wall s':>9} {'CPU s':>9} {'Peak MB':>9}")
+    print(f"   {'-' * 16} {'-' * 11} {'-' * 9} {'-' * 9} {'-' * 9}")
+    for name, result in results["scenarios"].items():
+        line = (f"   {name:<16} {result['round_trips']:>11} {result['wall']:>9.3f} "
+                f"{result['cpu']:>9.3f} {result['peak_memory'] / 1e6:>9.2f}")
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous and previous["wall"]:
+            line += f"   wall {100 * (result['wall'] - previous['wall']) / previous['wall']:+.0f}%"
+            line += f", round trips {result['round_trips'] - previous['round_trips']:+d}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark linuxsetup against a local SSH stand-in server')
+    parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS), help='Scenario to run (repeatable, default all)')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Seconds added to every remote exec and SFTP session')
+    parser.add_argument('-o', '--output', help=f'Result file (default {DEFAULT_RESULTS_PATH}/<commit>-<time>.json)')
+    parser.add_argument('--compare', metavar='FILE', help='Earlier result file to compare against')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    setup_config()
+    results = {
+        "commit":    git_commit(),
+        "time":      time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python":    platform.python_version(),
+        "latency":   args.latency,
+        "scenarios": {},
+    }
+    for name in args.scenario or list(SCENARIOS):
+        results["scenarios"][name] = run_scenario(name, args.latency)
+
+    output = args.output or os.path.join(os.path.expanduser(DEFAULT_RESULTS_PATH),
+                                         f"{results['commit'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=4)
+
+    print_results(results, baseline)
+    print(f"\n   Results written to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,560 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# SSH connection manager: one authenticated transport per (host, port, user, profile)
+# with keepalives, a small pool of pre-opened channels and transparent reconnect.
+# Hosts are resolved through ~/.ssh/config (HostName, Port, User, IdentityFile,
+# ProxyJump); all their addresses are raced and failed attempts are retried
+# with exponential backoff until the connect deadline. A named transport
+# profile sets the ciphers, MACs, compression, window and packet sizes.
+
+import  os
+import  time
+import  codecs
+import  queue
+import  random
+import  select
+import  socket
+import  threading
+
+from    global_config                   import GlobalConfig
+from    tracing                         import span
+from    host_log                        import get_host_log
+
+DEFAULT_MAX_CHANNELS = 10       # sshd's default MaxSessions
+DEFAULT_POOL_SIZE    = 2
+DEFAULT_KEEPALIVE    = 30
+DEFAULT_TIMEOUT      = 10       # per connection attempt
+DEFAULT_DEADLINE     = 60       # for all attempts together
+DEFAULT_RACE_DELAY   = 0.25     # RFC 8305 "connection attempt delay"
+BACKOFF_BASE         = 0.5
+BACKOFF_MAX          = 8
+SSH_CONFIG_FILE      = "~/.ssh/config"
+DEFAULT_EXEC_TIMEOUT = 60
+DEFAULT_MAX_OUTPUT   = 8 * 1024 * 1024  # per stream
+EXEC_RECV_SIZE       = 32768
+EXEC_SEND_POLL       = 0.05
+DEFAULT_PROFILE      = "default"
+
+# SSHException messages of handshakes that may work on the next attempt: the
+# host is still booting or dropped the connection during banner or key exchange
+TRANSIENT_SSH_ERRORS = ("banner", "kex", "key exchange", "negotiat", "reset", "timed out", "timeout", "eof")
+
+# Transport tuning profiles. "ssh profiles <name>" in the configuration adds
+# profiles or overrides settings of these; "ssh profile" selects the one used.
+#   ciphers, macs, kex: preference order, names paramiko doesn't implement are skipped
+#   compression:        zlib compression, pays off for text output over slow links
+#   window_size:        per channel, at least bandwidth x round trip time to keep a link busy
+#   max_packet_size:    largest data packet the server may send on a channel
+TRANSPORT_PROFILES = {
+    "default": {},
+    "lan": {
+        "ciphers":         ["aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "chacha20-poly1305@openssh.com",
+                            "aes128-ctr", "aes256-ctr"],
+        "macs":            ["hmac-sha2-256-etm@openssh.com", "hmac-sha2-256", "hmac-sha2-512"],
+        "compression":     False,
+        "window_size":     16 * 1024 * 1024,
+        "max_packet_size": 65536,
+    },
+    "wan": {
+        "ciphers":         ["aes128-gcm@openssh.com", "chacha20-poly1305@openssh.com", "aes128-ctr"],
+        "macs":            ["hmac-sha2-256-etm@openssh.com", "hmac-sha2-256"],
+        "compression":     True,
+        "window_size":     8 * 1024 * 1024,
+        "max_packet_size": 32768,
+    },
+}
+
+_connections      = {}
+_connections_lock = threading.Lock()
+_ssh_config       = {"mtime": None, "config": None}
+_ssh_config_lock  = threading.Lock()
+
+def load_ssh_config(path=SSH_CONFIG_FILE):
+    # Parsed ssh client config, cached until the file changes
+    import paramiko
+
+    path = os.path.expanduser(path)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    with _ssh_config_lock:
+        if _ssh_config["config"] is None or _ssh_config["mtime"] != mtime:
+            config = paramiko.SSHConfig()
+            if mtime is not None:
+                with open(path) as f:
+                    config.parse(f)
+            _ssh_config.update(mtime=mtime, config=config)
+        return _ssh_config["config"]
+
+def transport_profile(name=None):
+    # Settings of a transport profile, the configured one if name is None
+    global_config = GlobalConfig()
+    name       = name or global_config.get("ssh profile", DEFAULT_PROFILE)
+    configured = global_config.get("ssh profiles") or {}
+    if name not in TRANSPORT_PROFILES and name not in configured:
+        raise ValueError(f"Unknown transport profile '{name}', "
+                         f"available: {', '.join(transport_profile_names())}")
+    return {**TRANSPORT_PROFILES.get(name, {}), **configured.get(name, {})}
+
+def transport_profile_names():
+    return list(dict.fromkeys([*TRANSPORT_PROFILES, *(GlobalConfig().get("ssh profiles") or {})]))
+
+def ssh_host_config(hostname):
+    return load_ssh_config().lookup(hostname)
+
+def is_transient(error):
+    # Connection errors worth another attempt. Authentication, host key and
+    # name resolution errors won't go away by waiting.
+    import paramiko
+
+    if isinstance(error, (paramiko.AuthenticationException, paramiko.BadHostKeyException,
+                          socket.gaierror, socket.herror)):
+        return False
+    if isinstance(error, paramiko.SSHException):
+        message = str(error).lower()
+        return any(word in message for word in TRANSIENT_SSH_ERRORS)
+    return isinstance(error, (OSError, EOFError))
+
+def race_connect(hostname, port, timeout=DEFAULT_TIMEOUT, delay=DEFAULT_RACE_DELAY):
+    # Happy eyeballs: resolve all A/AAAA records and start a connection attempt
+    # every `delay` seconds (or as soon as one fails), alternating address
+    # families. The first socket to connect wins, late ones are closed.
+    families = {}
+    for info in socket.getaddrinfo(hostname, port, type=socket.SOCK_STREAM):
+        if info[4] not in [other[4] for other in families.get(info[0], [])]:
+            families.setdefault(info[0], []).append(info)
+    ordered = []
+    lists = sorted(families.values(), key=lambda infos: infos[0][0] != socket.AF_INET6)
+    while any(lists):
+        for infos in lists:
+            if infos:
+                ordered.append(infos.pop(0))
+
+    results = queue.Queue()
+
+    def attempt(info):
+        family, type_, proto, _, address = info
+        sock = socket.socket(family, type_, proto)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(address)
+        except OSError as e:
+            sock.close()
+            results.put((None, e))
+            return
+        results.put((sock, None))
+
+    def start():
+        threading.Thread(target=attempt, args=(ordered.pop(0),), daemon=True).start()
+
+    end_time = time.monotonic() + timeout
+    start()
+    pending = 1
+    winner  = None
+    error   = None
+    while pending:
+        remaining = end_time - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            sock, failure = results.get(timeout=min(delay, remaining) if ordered else remaining)
+        except queue.Empty:
+            if ordered:
+                start()
+                pending += 1
+            continue
+        pending -= 1
+        if sock is not None:
+            winner = sock
+            break
+        error = failure
+        if ordered:
+            start()
+            pending += 1
+
+    if pending:
+        def close_late(count):
+            for _ in range(count):
+                sock, failure = results.get()
+                if sock is not None:
+                    sock.close()
+        threading.Thread(target=close_late, args=(pending,), daemon=True).start()
+
+    if winner is None:
+        raise error or socket.timeout(f"timed out connecting to {hostname}:{port}")
+    winner.settimeout(None)
+    return winner
+
+class ExecResult:
+    # Outcome of SSHConnection.exec. exit_code is None if the command did not
+    # finish, timed_out tells if that was because of the deadline.
+    __slots__ = ("command", "exit_code", "stdout", "stderr", "duration",
+                 "stdout_truncated", "stderr_truncated", "timed_out")
+
+    def __init__(self, command, exit_code, stdout, stderr, duration,
+                 stdout_truncated=False, stderr_truncated=False, timed_out=False):
+        self.command          = command
+        self.exit_code        = exit_code
+        self.stdout           = stdout
+        self.stderr           = stderr
+        self.duration         = duration
+        self.stdout_truncated = stdout_truncated
+        self.stderr_truncated = stderr_truncated
+        self.timed_out        = timed_out
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    @property
+    def text(self):
+        return self.stdout.decode('utf-8', errors='replace')
+
+    @property
+    def error_text(self):
+        return self.stderr.decode('utf-8', errors='replace')
+
+    def __repr__(self):
+        return (f"ExecResult({self.command!r}, exit_code={self.exit_code}, stdout={len(self.stdout)}B, "
+                f"stderr={len(self.stderr)}B, duration={self.duration:.3f}s)")
+
+class SSHConnection:
+    # proxy_jump: overrides the ProxyJump of the ssh config, "none" disables it
+    # profile:    transport profile name, see TRANSPORT_PROFILES
+    def __init__(self, hostname, port, username, password=None,
+                 max_channels=DEFAULT_MAX_CHANNELS, pool_size=DEFAULT_POOL_SIZE,
+                 keepalive=DEFAULT_KEEPALIVE, timeout=DEFAULT_TIMEOUT,
+                 deadline=DEFAULT_DEADLINE, proxy_jump=None, profile=None):
+        self.hostname     = hostname
+        self.port         = port
+        self.username     = username
+        self.password     = password
+        self.max_channels = max(1, max_channels)
+        self.pool_size    = max(0, min(pool_size, self.max_channels - 1))
+        self.keepalive    = keepalive
+        self.timeout      = timeout
+        self.deadline     = deadline
+        self.proxy_jump   = proxy_jump
+        self.profile      = profile
+        self.settings     = transport_profile(profile)
+
+        self.client       = None
+        self.root_shell   = None
+        self._pool        = []
+        self._open_count  = 0
+        self._refilling   = 0           # pool channels being opened in the background
+        self._cond        = threading.Condition()
+        self._connect_lock = threading.Lock()
+
+    def connect(self):
+        # Retry failed attempts with exponential backoff and full jitter until
+        # the deadline; only transient errors are retried, see is_transient
+        import paramiko
+
+        host_config = ssh_host_config(self.hostname)
+        address     = host_config.get("hostname", self.hostname)
+        end_time    = time.monotonic() + self.deadline
+        attempt     = 0
+        with span(f"connect {self.hostname}", "connect", host=self.hostname) as trace:
+            while True:
+                timeout = max(0.1, min(self.timeout, end_time - time.monotonic()))
+                try:
+                    sock = self._open_socket(host_config, address, timeout)
+                    client = paramiko.SSHClient()
+                    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                    client.connect(
+                        hostname=address,
+                        username=self.username,
+                        password=self.password,
+                        port=self.port,
+                        sock=sock,
+                        timeout=timeout,
+                        banner_timeout=timeout,
+                        auth_timeout=timeout,
+                        key_filename=[os.path.expanduser(path) for path in host_config.get("identityfile", [])] or None,
+                        look_for_keys=True,
+                        allow_agent=True,
+                        compress=bool(self.settings.get("compression", False)),
+                        transport_factory=self._transport_factory
+                    )
+                    break
+                except (OSError, EOFError, paramiko.SSHException) as e:
+                    attempt += 1
+                    if not is_transient(e):
+                        trace.exit_code = attempt
+                        raise
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                    if time.monotonic() + delay >= end_time:
+                        trace.exit_code = attempt
+                        raise ConnectionError(f"{e} (after {attempt} attempts)") from e
+                    time.sleep(delay)
+            trace.exit_code = 0
+
+        client.get_transport().set_keepalive(self.keepalive)
+        self.client = client
+        return self
+
+    def _transport_factory(self, sock, **kwargs):
+        # paramiko Transport with the window, packet size and algorithms of the profile
+        import paramiko
+
+        if "window_size" in self.settings:
+            kwargs["default_window_size"] = int(self.settings["window_size"])
+        if "max_packet_size" in self.settings:
+            kwargs["default_max_packet_size"] = int(self.settings["max_packet_size"])
+        transport = paramiko.Transport(sock, **kwargs)
+
+        options = transport.get_security_options()
+        for key, attribute in (("ciphers", "ciphers"), ("macs", "digests"), ("kex", "kex")):
+            available = getattr(options, attribute)
+            preferred = tuple(name for name in self.settings.get(key) or () if name in available)
+            if preferred:
+                setattr(options, attribute, preferred)
+        return transport
+
+    def _open_socket(self, host_config, address, timeout):
+        # Direct connection, or a direct-tcpip channel through the ProxyJump host
+        proxy_jump = self.proxy_jump or host_config.get("proxyjump")
+        if not proxy_jump or proxy_jump.lower() == "none":
+            return race_connect(address, self.port, timeout)
+
+        # "a,b" reaches the target through b, which itself is reached through a
+        hops = proxy_jump.split(",")
+        username, hostname, port = None, hops[-1], None
+        if "@" in hostname:
+            username, hostname = hostname.split("@", 1)
+        if hostname.count(":") == 1:
+            hostname, port = hostname.split(":")
+            port = int(port)
+        jump = get_connection(hostname, port, username, timeout=self.timeout, deadline=self.deadline,
+                              proxy_jump=",".join(hops[:-1]) or None, profile=self.profile)
+        return jump.get_transport().open_channel("direct-tcpip", (address, self.port), ("127.0.0.1", 0),
+                                                 timeout=timeout)
+
+    def is_active(self):
+        transport = self.client.get_transport() if self.client else None
+        return transport is not None and transport.is_active()
+
+    def get_transport(self):
+        # Reconnect transparently if the transport has dropped
+        if not self.is_active():
+            with self._connect_lock:
+                if not self.is_active():
+                    self._reset()
+                    self.connect()
+        return self.client.get_transport()
+
+    def _reset(self):
+        with self._cond:
+            pool, self._pool = self._pool, []
+            self._open_count -= len(pool)
+            self._cond.notify_all()
+        for channel in pool:
+            channel.close()
+        if self.client:
+            self.client.close()
+
+    def open_channel(self):
+        # Hand out a pre-opened channel, waiting if max_channels are in use
+        with self._cond:
+            while True:
+                while self._pool:
+                    channel = self._pool.pop()
+                    if channel.active and not channel.closed:
+                        return channel
+                    self._open_count -= 1
+                if self._open_count < self.max_channels:
+                    self._open_count += 1
+                    break
+                self._cond.wait()
+
+        try:
+            return self.get_transport().open_session(timeout=self.timeout)
+        except BaseException:
+            with self._cond:
+                self._open_count -= 1
+                self._cond.notify()
+            raise
+
+    def release_channel(self, channel):
+        # Close a used channel and pre-open its replacement for the next command.
+        # The replacement is opened on a background thread, so the round trip
+        # overlaps with the caller's work instead of following the command.
+        channel.close()
+        with self._cond:
+            transport = None
+            if len(self._pool) + self._refilling < self.pool_size and self.is_active():
+                transport = self.client.get_transport()
+            if transport is None:
+                self._open_count -= 1
+            else:
+                self._refilling += 1
+            self._cond.notify()
+        if transport is not None:
+            threading.Thread(target=self._refill, args=(transport,), daemon=True).start()
+
+    def _refill(self, transport):
+        # Open one pool channel, its slot is already counted in _open_count
+        try:
+            fresh = transport.open_session(timeout=self.timeout)
+        except Exception:
+            fresh = None
+        with self._cond:
+            self._refilling -= 1
+            if fresh is None:
+                self._open_count -= 1
+            else:
+                self._pool.append(fresh)
+            self._cond.notify()
+
+    def exec(self, command, input=None, timeout=DEFAULT_EXEC_TIMEOUT, max_output=DEFAULT_MAX_OUTPUT, cancel=None,
+             callback=None, pty=False):
+        # Run a command and return an ExecResult. stdout and stderr are drained
+        # together so neither can fill the channel window and stall the command;
+        # each keeps at most max_output bytes. input is sent to stdin, which is
+        # closed afterwards. timeout is the deadline for the whole call, 0 disables it.
+        # cancel: optional threading.Event that abandons the command when set
+        # callback: optional callable receiving each stdout chunk as it arrives
+        # pty:      run on a pseudo-terminal (stderr then arrives on stdout). Closing
+        #           the channel on timeout or cancel hangs up the terminal, which
+        #           ends the remote command; without a pty it keeps running.
+        log = get_host_log(self.hostname, self.port)
+        start_time = time.perf_counter()
+        deadline = start_time + timeout if timeout else None
+        buffers = (bytearray(), bytearray())
+        truncated = [False, False]
+        exit_code = None
+        # one decoder per stream for the host log, characters may span chunks
+        decoders = [codecs.getincrementaldecoder('utf-8')(errors='replace') for _ in buffers]
+
+        def keep(index, data):
+            room = max_output - len(buffers[index])
+            if room > 0:
+                buffers[index].extend(data[:room])
+            if len(data) > room:
+                truncated[index] = True
+            trace.received(len(data))
+            text = decoders[index].decode(data)
+            if text:
+                log.write(log_id, text)
+            if index == 0 and callback is not None:
+                callback(data)
+
+        with span(command, "exec", host=self.hostname) as trace:
+            log_id = log.begin(command)
+            channel = self.open_channel()
+            try:
+                if pty:
+                    channel.get_pty()
+                channel.exec_command(command)
+                pending = memoryview(input.encode('utf-8') if isinstance(input, str) else (input or b""))
+                if not pending:
+                    channel.shutdown_write()
+
+                while True:
+                    # data arrives before the exit status and the close, so
+                    # once these are seen the drain below collects everything
+                    finished = channel.exit_status_ready() or channel.closed
+                    while pending and channel.send_ready():
+                        sent = channel.send(pending[:EXEC_RECV_SIZE])
+                        trace.sent(sent)
+                        pending = pending[sent:]
+                        if not pending:
+                            channel.shutdown_write()
+                    while channel.recv_ready():
+                        keep(0, channel.recv(EXEC_RECV_SIZE))
+                    while channel.recv_stderr_ready():
+                        keep(1, channel.recv_stderr(EXEC_RECV_SIZE))
+
+                    if finished:
+                        if channel.exit_status_ready():
+                            exit_code = channel.recv_exit_status()
+                        break
+
+                    wait = None if deadline is None else deadline - time.perf_counter()
+                    if (wait is not None and wait <= 0) or (cancel is not None and cancel.is_set()):
+                        break
+                    if pending or cancel is not None:
+                        # a full send window or a cancel request are not signalled, poll for them
+                        wait = EXEC_SEND_POLL if wait is None else min(wait, EXEC_SEND_POLL)
+                    select.select([channel], [], [], wait)
+            finally:
+                trace.exit_code = exit_code
+                for decoder in decoders:
+                    text = decoder.decode(b"", final=True)
+                    if text:
+                        log.write(log_id, text)
+                log.end(log_id, exit_code, time.perf_counter() - start_time)
+                self.release_channel(channel)
+
+        return ExecResult(command, exit_code, bytes(buffers[0]), bytes(buffers[1]),
+                          time.perf_counter() - start_time, truncated[0], truncated[1],
+                          timed_out=exit_code is None and deadline is not None and time.perf_counter() >= deadline)
+
+    def open_sftp(self):
+        # SFTP session on a channel from the pool, release it with close_sftp()
+        import paramiko
+
+        channel = self.open_channel()
+        try:
+            channel.invoke_subsystem('sftp')
+            return paramiko.SFTPClient(channel)
+        except BaseException:
+            self.release_channel(channel)
+            raise
+
+    def close_sftp(self, sftp):
+        channel = sftp.get_channel()
+        sftp.close()
+        self.release_channel(channel)
+
+    def invoke_shell(self):
+        channel = self.open_channel()
+        channel.get_pty()
+        channel.invoke_shell()
+        return channel
+
+    def get_root_shell(self):
+        # Persistent root shell, opened on first use with the login password for sudo
+        from root_shell import RootShell
+
+        with self._connect_lock:
+            if self.root_shell is None:
+                self.root_shell = RootShell(self, self.password)
+        return self.root_shell
+
+    def close(self):
+        if self.root_shell is not None:
+            self.root_shell.close()
+            self.root_shell = None
+        with _connections_lock:
+            if _connections.get(self.key()) is self:
+                del _connections[self.key()]
+        self._reset()
+
+    def key(self):
+        return (self.hostname, self.port, self.username, self.profile)
+
+def get_connection(hostname, port=None, username=None, password=None, **kwargs):
+    # Return the cached connection for (host, port, user, profile), connecting on first use.
+    # Port and user not given are taken from the ssh config, or 22 and root.
+    host_config = ssh_host_config(hostname)
+    port     = int(port or host_config.get("port", 22))
+    username = username or host_config.get("user", "root")
+    key = (hostname, port, username, kwargs.get("profile"))
+    with _connections_lock:
+        connection = _connections.get(key)
+        if connection is None:
+            connection = SSHConnection(hostname, port, username, password, **kwargs)
+            _connections[key] = connection
+    try:
+        connection.get_transport()
+    except BaseException:
+        with _connections_lock:
+            if _connections.get(key) is connection:
+                del _connections[key]
+        raise
+    return connection
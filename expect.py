@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Small expect engine for interactive channels: compiled regex patterns,
+# a deadline per call and a bounded search buffer
+
+import  re
+import  time
+import  codecs
+import  select
+
+from    server                          import RECV_SIZE
+
+DEFAULT_TIMEOUT    = 30
+DEFAULT_MAX_BUFFER = 65536
+
+class ExpectTimeout(TimeoutError):
+    def __init__(self, message, buffer=""):
+        super().__init__(message)
+        self.buffer = buffer
+
+class ExpectEOF(EOFError):
+    def __init__(self, message, buffer=""):
+        super().__init__(message)
+        self.buffer = buffer
+
+class Expect:
+    # overflow: optional callable receiving text that drops out of the buffer,
+    #           e.g. to keep the full output of a long command
+    def __init__(self, channel, max_buffer=DEFAULT_MAX_BUFFER, overflow=None, trace=None):
+        self.channel    = channel
+        self.max_buffer = max_buffer
+        self.overflow   = overflow
+        self.trace      = trace
+        self.decoder    = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.buffer     = ""
+        self.before     = ""
+        self.match      = None
+
+    def send(self, text):
+        data = text.encode('utf-8')
+        self.channel.sendall(data)
+        if self.trace is not None:
+            self.trace.sent(len(data))
+
+    def sendline(self, text=""):
+        self.send(text + "\n")
+
+    def _trim(self):
+        # Called after a failed search, so no match is lost
+        if len(self.buffer) > self.max_buffer:
+            cut = len(self.buffer) - self.max_buffer
+            if self.overflow is not None:
+                self.overflow(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+
+    def _read(self, wait):
+        # Read whatever is available within wait seconds, False on end of stream
+        if not self.channel.recv_ready():
+            if self.channel.eof_received or self.channel.closed:
+                return False
+            select.select([self.channel], [], [], wait)
+        while self.channel.recv_ready():
+            data = self.channel.recv(RECV_SIZE)
+            if not data:
+                return False
+            if self.trace is not None:
+                self.trace.received(len(data))
+            self.buffer += self.decoder.decode(data)
+        return not (self.channel.eof_received and not self.channel.recv_ready())
+
+    def expect(self, patterns, timeout=DEFAULT_TIMEOUT):
+        # Wait for the first of the patterns (strings or compiled regexes),
+        # returns its index. The text before the match is kept in .before and
+        # the match object in .match; the buffer continues after the match.
+        patterns = [re.compile(p) if isinstance(p, str) else p for p in patterns]
+        deadline = time.monotonic() + timeout if timeout else None
+
+        while True:
+            found = None
+            for index, pattern in enumerate(patterns):
+                match = pattern.search(self.buffer)
+                if match and (found is None or match.start() < found[1].start()):
+                    found = (index, match)
+            if found is not None:
+                index, match = found
+                self.before = self.buffer[:match.start()]
+                self.match  = match
+                self.buffer = self.buffer[match.end():]
+                return index
+            self._trim()
+
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    raise ExpectTimeout(f"Timed out after {timeout} seconds waiting for "
+                                        f"{', '.join(p.pattern for p in patterns)}", self.buffer)
+            if not self._read(wait):
+                self.buffer += self.decoder.decode(b'', final=True)
+                if not any(p.search(self.buffer) for p in patterns):
+                    raise ExpectEOF("Channel closed while waiting for "
+                                    f"{', '.join(p.pattern for p in patterns)}", self.buffer)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Host facts: one composite remote probe, cached on disk with a TTL
+
+import  os
+import  re
+import  json
+import  time
+
+from    global_config                   import GlobalConfig, DEFAULT_CONFIG_ROOT
+
+DEFAULT_FACTS_PATH = os.path.join(DEFAULT_CONFIG_ROOT, "facts")
+DEFAULT_FACTS_TTL  = 3600
+
+# Every section is introduced by a "@@name" marker line
+FACTS_PROBE = r"""
+echo '@@os';         grep '^PRETTY_NAME=' /etc/os-release | cut -d '=' -f 2 | tr -d '"'
+echo '@@hostname';   hostname
+echo '@@selinux';    getenforce 2>/dev/null || echo Disabled
+echo '@@timezone';   timedatectl 2>/dev/null | sed -n 's/^ *Time zone: *\([^ ]*\).*/\1/p'
+echo '@@ntp';        timedatectl 2>/dev/null | sed -n 's/^ *\(NTP enabled\|NTP service\|Network time on\): *//p'
+echo '@@packages';   rpm -qa --qf '%{NAME}\n' 2>/dev/null
+echo '@@authorized_keys'; [ -f ~/.ssh/authorized_keys ] && ssh-keygen -lf ~/.ssh/authorized_keys 2>/dev/null
+echo '@@public_ip';  curl -s -m 10 checkip.dyndns.com
+echo '@@end'
+"""
+
+def parse_facts(output):
+    sections = {}
+    name = None
+    for line in output.splitlines():
+        if line.startswith("@@"):
+            name = line[2:].strip()
+            sections[name] = []
+        elif name is not None and line.strip():
+            sections[name].append(line.strip())
+
+    def first(name):
+        lines = sections.get(name) or [""]
+        return lines[0]
+
+    match = re.search(r"(\d{1,3}(\.\d{1,3}){3})", " ".join(sections.get("public_ip", [])))
+    fingerprints = []
+    for line in sections.get("authorized_keys", []):
+        # "256 SHA256:... comment (ED25519)"
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].startswith("SHA256:"):
+            fingerprints.append(fields[1])
+
+    return {
+        "os":              first("os"),
+        "hostname":        first("hostname"),
+        "selinux":         first("selinux"),
+        "timezone":        first("timezone"),
+        "ntp":             first("ntp") in ("yes", "active"),
+        "packages":        sorted(set(sections.get("packages", []))),
+        "authorized_keys": fingerprints,
+        "public_ip":       match.group(1) if match else None,
+        "complete":        "end" in sections,
+    }
+
+def facts_cache_file(hostname, port):
+    path = GlobalConfig().get("facts path", DEFAULT_FACTS_PATH)
+    return os.path.join(os.path.expanduser(path), f"{hostname}_{port}.json")
+
+def load_cached_facts(hostname, port, ttl=None):
+    if ttl is None:
+        ttl = GlobalConfig().get("facts ttl", DEFAULT_FACTS_TTL)
+    try:
+        with open(facts_cache_file(hostname, port)) as f:
+            facts = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if ttl <= 0 or time.time() - facts.get("collected", 0) > ttl:
+        return None
+    return facts
+
+def save_facts(hostname, port, facts):
+    cache_file = facts_cache_file(hostname, port)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    temp_file = cache_file + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(facts, f, indent=4)
+    os.replace(temp_file, cache_file)
+
+def invalidate_facts(hostname, port):
+    try:
+        os.remove(facts_cache_file(hostname, port))
+    except OSError:
+        pass
+
+def collect_facts(connection):
+    # Run the composite probe in a single round trip
+    facts = parse_facts(connection.exec(FACTS_PROBE).text)
+    facts["collected"] = time.time()
+    return facts
+
+def get_facts(connection, refresh=False, ttl=None):
+    # Return cached facts for the host unless they are stale or refresh is set
+    facts = None if refresh else load_cached_facts(connection.hostname, connection.port, ttl)
+    if facts is None:
+        facts = collect_facts(connection)
+        if facts["complete"]:
+            save_facts(connection.hostname, connection.port, facts)
+    return facts
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Fleet mode: initialize many hosts concurrently
+
+import  sys
+import  time
+import  threading
+from    concurrent.futures              import ThreadPoolExecutor, as_completed
+
+from    get_server                      import get_server
+
+DEFAULT_WORKERS = 8
+
+class HostOutput:
+    # sys.stdout replacement that routes writes from worker threads into a
+    # per-host buffer, everything else goes straight to the real stdout
+    def __init__(self, stream):
+        self.stream = stream
+        self.local  = threading.local()
+
+    def start(self):
+        self.local.buffer = []
+
+    def stop(self):
+        buffer = getattr(self.local, "buffer", None) or []
+        self.local.buffer = None
+        # apply the backspaces written by the progress spinner
+        text = []
+        for char in "".join(buffer):
+            if char != "\b":
+                text.append(char)
+            elif text and text[-1] != "\n":
+                text.pop()
+        return "".join(text)
+
+    def write(self, data):
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            return self.stream.write(data)
+        buffer.append(data)
+        return len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def parse_host(spec, username=None, port=None):
+    # [user@]host[:port], user and port not given come from ~/.ssh/config
+    if '@' in spec:
+        username, spec = spec.split('@', 1)
+    if spec.count(':') == 1:
+        spec, port = spec.split(':')
+        port = int(port)
+    return spec, port, username
+
+def read_inventory(path, username=None, port=None):
+    # One host per line: "[user@]host[:port] [new-hostname] [timezone]", '#' starts a comment
+    hosts = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            hostname, host_port, host_user = parse_host(fields[0], username, port)
+            hosts.append({
+                "host":         hostname,
+                "port":         host_port,
+                "username":     host_user,
+                "new_hostname": fields[1] if len(fields) > 1 else None,
+                "timezone":     fields[2] if len(fields) > 2 else None,
+            })
+    return hosts
+
+def initialize_host(entry, answers, password=None, plan=False, rpm_cache=None, script=False, profile=None):
+    result = {"host": entry["host"], "port": entry["port"], "status": "ok", "duration": 0.0, "failures": []}
+    start_time = time.monotonic()
+    server = None
+    try:
+        server = get_server(entry["host"], entry["port"], entry["username"], password, interactive=False,
+                            profile=profile, plan=plan)
+        if server is None:
+            raise RuntimeError("unsupported OS")
+        server.rpm_cache = rpm_cache
+        if script:
+            server.script_mode = True
+        result["failures"] = server.os_initialization(answers, plan=plan)
+        if result["failures"]:
+            result["status"] = "pending" if plan else "failed"
+    except BaseException as e:
+        if isinstance(e, KeyboardInterrupt):
+            raise
+        result["status"] = "error"
+        result["failures"].append(str(e) or type(e).__name__)
+    finally:
+        if server is not None:
+            server.close()
+        result["duration"] = time.monotonic() - start_time
+    return result
+
+def print_summary(results):
+    from answers import host_address    # answers imports this module
+    print("\n o Fleet summary")
+    print(f"   {'Host':<30} {'Status':<8} {'Duration':>9}  Failures")
+    print(f"   {'-' * 30} {'-' * 8} {'-' * 9}  {'-' * 20}")
+    for result in results:
+        failures = "; ".join(result["failures"]) or "-"
+        print(f"   {host_address(result['host'], result['port']):<30} {result['status']:<8} {result['duration']:>8.1f}s  {failures}")
+
+def run_fleet(hosts, answers, password=None, workers=DEFAULT_WORKERS, plan=False, rpm_cache=None, script=False,
+              profile=None):
+    # answers:   validated answers by inventory (host, port), see answers.Answers.validate
+    # rpm_cache: controller RPM cache, the first host then runs alone to fill it
+    # script:    apply each host's steps as one compiled script, see plan_script.py
+    # profile:   SSH transport profile, see connection.TRANSPORT_PROFILES
+    print(f"\nInitializing {len(hosts)} hosts with {workers} workers")
+    print("------------------------------------------------------------")
+
+    from answers import host_address
+    output = HostOutput(sys.stdout)
+    print_lock = threading.Lock()
+
+    def worker(entry):
+        output.start()
+        try:
+            return initialize_host(entry, answers[(entry["host"], entry["port"])], password, plan, rpm_cache, script, profile)
+        finally:
+            text = output.stop()
+            with print_lock:
+                print(f"\n===== {host_address(entry['host'], entry['port'])} =====")
+                print(text, end="" if text.endswith("\n") else "\n", flush=True)
+
+    results = []
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            remaining = hosts
+            if rpm_cache is not None and not plan and len(hosts) > 1:
+                # only the first host downloads from the mirrors
+                results.append(executor.submit(worker, hosts[0]).result())
+                remaining = hosts[1:]
+            futures = [executor.submit(worker, entry) for entry in remaining]
+            for future in as_completed(futures):
+                results.append(future.result())
+    finally:
+        sys.stdout = output.stream
+
+    # the same host may be listed with different ports
+    order = {(entry["host"], entry["port"]): index for index, entry in enumerate(hosts)}
+    results.sort(key=lambda result: order.get((result["host"], result["port"]), 0))
+    print_summary(results)
+    return all(result["status"] in ("ok", "pending") for result in results)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# IP geolocation with an on-disk cache, an optional local CIDR database and
+# pluggable online providers
+
+import  os
+import  csv
+import  json
+import  time
+import  bisect
+import  ipaddress
+import  threading
+
+from    global_config                   import GlobalConfig, DEFAULT_CONFIG_ROOT
+from    tracing                         import span
+
+DEFAULT_CACHE_FILE = os.path.join(DEFAULT_CONFIG_ROOT, "cache/geolocation.json")
+DEFAULT_CACHE_TTL  = 30 * 24 * 3600
+DEFAULT_TIMEOUT    = 5
+
+def ip_prefix(ip_address):
+    # Hosts in the same /24 (IPv4) or /48 (IPv6) share one cache entry
+    address = ipaddress.ip_address(ip_address)
+    prefix  = 24 if address.version == 4 else 48
+    return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+
+class IpinfoProvider:
+    # ipinfo.io lookups over a pooled HTTP session
+    def __init__(self, timeout=DEFAULT_TIMEOUT, token=None):
+        self.timeout = timeout
+        self.token   = token
+        self.session = None
+        self.lock    = threading.Lock()
+
+    def lookup(self, ip_address):
+        import requests
+
+        with self.lock:
+            if self.session is None:
+                self.session = requests.Session()
+        params = {"token": self.token} if self.token else None
+        with span(f"ipinfo.io {ip_address}", "http") as trace:
+            try:
+                response = self.session.get(f"https://ipinfo.io/{ip_address}/json", params=params, timeout=self.timeout)
+            except requests.RequestException:
+                return None
+            trace.received(len(response.content))
+            trace.exit_code = response.status_code
+        if response.status_code != 200:
+            return None
+        info = response.json()
+        return {
+            "timezone": info.get('timezone'),
+            "city":     info.get('city'),
+            "region":   info.get('region'),
+            "country":  info.get('country'),
+        }
+
+class LocalDatabase:
+    # Offline CIDR database, a CSV file of "network,timezone,city,region,country".
+    # Nested networks are flattened at load time into sorted, non-overlapping
+    # segments that carry the most specific network's info, so a lookup is one
+    # bisect and one comparison.
+    def __init__(self, path):
+        ranges = []
+        with open(os.path.expanduser(path), newline='') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                network = ipaddress.ip_network(row[0].strip(), strict=False)
+                fields  = [field.strip() or None for field in row[1:5]] + [None] * 4
+                ranges.append((network.version, int(network.network_address), int(network.broadcast_address), {
+                    "timezone": fields[0],
+                    "city":     fields[1],
+                    "region":   fields[2],
+                    "country":  fields[3],
+                }))
+        # outer networks first, so each one is followed by the networks inside it
+        ranges.sort(key=lambda item: (item[0], item[1], -item[2]))
+        self.ranges = self._flatten(ranges)
+        self.starts = [(version, start) for version, start, end, info in self.ranges]
+
+    @staticmethod
+    def _flatten(ranges):
+        # CIDR networks are either nested or disjoint; sweep them with a stack of
+        # the enclosing networks and emit the part of each one not covered by inner ones
+        segments = []
+        stack    = []
+        cursor   = 0
+
+        def close(until_version=None, until_start=None):
+            nonlocal cursor
+            while stack and (until_version is None or stack[-1][0] != until_version or stack[-1][2] < until_start):
+                version, start, end, info = stack.pop()
+                if cursor <= end:
+                    segments.append((version, cursor, end, info))
+                cursor = end + 1
+
+        for version, start, end, info in ranges:
+            close(version, start)
+            if stack and cursor < start:
+                segments.append((version, cursor, start - 1, stack[-1][3]))
+            cursor = start
+            stack.append((version, start, end, info))
+        close()
+        return segments
+
+    def lookup(self, ip_address):
+        address = ipaddress.ip_address(ip_address)
+        index   = bisect.bisect_right(self.starts, (address.version, int(address))) - 1
+        if index >= 0:
+            version, start, end, info = self.ranges[index]
+            if version == address.version and start <= int(address) <= end:
+                return dict(info)
+        return None
+
+class GeoResolver:
+    def __init__(self, provider=None, database=None, cache_file=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL):
+        self.provider   = provider
+        self.database   = database
+        self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+        self.ttl        = ttl
+        self.lock       = threading.Lock()
+        self.cache      = self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_file:
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.cache, f, indent=4)
+        os.replace(temp_file, self.cache_file)
+
+    def lookup(self, ip_address):
+        # Local database first, then the cache, then the online provider
+        if self.database is not None:
+            info = self.database.lookup(ip_address)
+            if info:
+                return info
+
+        key = ip_prefix(ip_address)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and time.time() - entry.get("time", 0) < self.ttl:
+                return entry["info"]
+
+        if self.provider is None:
+            return None
+        info = self.provider.lookup(ip_address)
+        if info and self.cache_file:
+            with self.lock:
+                self.cache[key] = {"time": time.time(), "info": info}
+                self._save_cache()
+        return info
+
+_resolver      = None
+_resolver_lock = threading.Lock()
+
+def get_resolver():
+    # Shared resolver configured from GlobalConfig "geolocation ..." settings
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            global_config = GlobalConfig()
+            database_path = global_config.get("geolocation database")
+            database = None
+            if database_path and os.path.exists(os.path.expanduser(database_path)):
+                database = LocalDatabase(database_path)
+            provider = None
+            if global_config.get("geolocation online", True):
+                provider = IpinfoProvider(timeout=global_config.get("geolocation timeout", DEFAULT_TIMEOUT),
+                                          token=global_config.get("geolocation token"))
+            _resolver = GeoResolver(provider=provider, database=database,
+                                    cache_file=global_config.get("geolocation cache", DEFAULT_CACHE_FILE),
+                                    ttl=global_config.get("geolocation ttl", DEFAULT_CACHE_TTL))
+        return _resolver
+
+def set_resolver(resolver):
+    # Replace the shared resolver, e.g. with a local stand-in provider in tests
+    global _resolver
+    with _resolver_lock:
+        _resolver = resolver
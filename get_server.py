@@ -5,23 +5,23 @@
 import os
 import sys
 import re
-import time
 import logging
-import paramiko
 
-from redhat import RedhatServer
-from server import server_run_cmd
+from backends import find_backend
+from global_config import GlobalConfig
+from facts import get_facts
+from history import get_history
+from connection import get_connection, DEFAULT_MAX_CHANNELS, DEFAULT_KEEPALIVE, DEFAULT_DEADLINE
+from root_shell import RootShellError
+from expect import ExpectTimeout, ExpectEOF
+
+def get_server(hostname, port=None, username=None, password=None, verbose=False, interactive=True, profile=None,
+               plan=False):
+    # plan:        the host is only inspected, nothing on it is changed (--plan)
+    # interactive: prompt again and exit on failures, otherwise raise ConnectionError
+    #              and return None for an unsupported OS
+    import paramiko
 
-os_supported = {
-    "rhel": {
-        "versions": ["CentOS Linux 7", "CentOS Linux 8", "Oracle Linux 8", "Oracle Linux 9", "Rocky Linux 8", "Rocky Linux 9"]
-    },
-    "ubuntu": {
-        "versions": ["Ubuntu 18", "Ubuntu 20", "Ubuntu 22", "Ubuntu 24"]
-    },
-}
-
-def get_server(hostname, port, username, password, verbose=False):
     if verbose:
         # Enable paramiko logging
         logging.basicConfig(level=logging.DEBUG)
@@ -38,56 +38,36 @@ def get_server(hostname, port, username, password, verbose=False):
         "ssh-dss",
     )        
 
-    # load ssh config under home
-    ssh_config_file = os.path.expanduser('~/.ssh/config')
-    if os.path.exists(ssh_config_file):
-        ssh_config = paramiko.SSHConfig()
-        with open(ssh_config_file) as f:
-            ssh_config.parse(f)
-
-        # Match the given hostname against the SSH config file
-        host_config = ssh_config.lookup(hostname)
-
-        # Apply settings from ~/.ssh/config if they are not explicitly provided
-        if 'user' in host_config and not username:
-            username = host_config['user']
-        if 'port' in host_config and not port:
-            port = int(host_config['port'])
-
-    # Set default port if not provided
-    if not port:
-        port = 22  
+    global_config = GlobalConfig()
+    options = {
+        "max_channels": global_config.get("ssh max_channels", DEFAULT_MAX_CHANNELS),
+        "keepalive":    global_config.get("ssh keepalive", DEFAULT_KEEPALIVE),
+        "deadline":     global_config.get("ssh connect_deadline", DEFAULT_DEADLINE),
+        "profile":      profile,
+    }
 
-    # create ssh client
-    ssh_client = paramiko.SSHClient()
-    ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # Attempt to connect until successful
+    # ~/.ssh/config is applied by the connection layer, which also retries
+    # until the connect deadline
     while True:
         try:                
-            ssh_client.connect(
-                hostname=hostname,
-                username=username,
-                password=password,
-                port=port,
-                timeout=10,
-                look_for_keys=True,
-                allow_agent=True
-            )
+            connection = get_connection(hostname, port, username, password, **options)
             print(f"SSH connection established with {hostname}.")
             break
         except Exception as e:
             print(f"Failed to connect to {hostname}: {e}")
+            if not interactive:
+                raise ConnectionError(f"Failed to connect to {hostname}: {e}")
             # If connection fails, prompt for new input
             print("\nPlease re-enter the connection details:")
             hostname   = input(f"Hostname (or IP address) [{hostname}]: ") or hostname
-            username   = input(f"Username [{username}]): ") or username
+            username   = input(f"Username [{username or 'from ssh config'}]): ") or username
             password   = input("Password (Empty to use ssh key): ") or None
-            port       = input(f"SSH Port [{port}]: ") or port
+            port       = int(input(f"SSH Port [{port or 'from ssh config'}]: ") or port or 0) or None
+    username = connection.username
 
     # Detect and verify the supproted OS type
-    stdin, stdout, stderr = ssh_client.exec_command("grep '^PRETTY_NAME=' /etc/os-release | cut -d '=' -f 2 | tr -d '\"'")
-    os_detected = stdout.read().decode('utf-8')
+    facts = get_facts(connection)
+    os_detected = facts["os"]
 
     def extract_os_version(os_string):
         match = re.match(r"([^\d]*\d+)", os_string)
@@ -96,40 +76,42 @@ def get_server(hostname, port, username, password, verbose=False):
     os_detected = extract_os_version(os_detected)
     print(f"Detected OS: {os_detected}")
 
+    history = get_history()
+    if history is not None:
+        history.record_host(connection.hostname, connection.port, os_detected, facts)
+
     # enable passwordless sudo
-    # Switch to root user if not already
-    if username != "root":   
-        shell = ssh_client.invoke_shell()
-        shell.settimeout(30)
-        shell.send('sudo -i\n')
-        
-        buff = ''
-        passowrd_required = False
-        while True:
-            buff += shell.recv(1024).decode('utf-8')
-            if buff.endswith(': ') and 'password for' in buff:
-                shell.send(password + '\n')
-                passowrd_required = True
-            elif buff.endswith('# '):
-                break
-            time.sleep(0.1)            
+    # Switch to root user if not already, the root shell stays open for later commands
+    if username != "root":
+        root_shell = connection.get_root_shell()
+        try:
+            root_shell.open()
+        except (RootShellError, ExpectTimeout, ExpectEOF) as e:
+            print(f"Failed to switch to root user: {e}")
+            connection.close()
+            if not interactive:
+                raise ConnectionError(str(e))
+            sys.exit(1)
         print("Switched to root user")
 
-        if passowrd_required:
-            sudo_users = f"{username} ALL=(ALL)       NOPASSWD: ALL\n"
-            cmd = f"echo '{sudo_users}' >> /etc/sudoers.d/{username}\n"
-            shell.send(cmd)
-            time.sleep(0.1)
-            print("Passwordless sudo enabled") 
+        if root_shell.password_required and plan:
+            print("Passwordless sudo not enabled, planning only")
+        elif root_shell.password_required:
+            sudo_users = f"{username} ALL=(ALL)       NOPASSWD: ALL"
+            exit_status, _ = root_shell.run(f"echo '{sudo_users}' > /etc/sudoers.d/{username} && "
+                                            f"chmod 440 /etc/sudoers.d/{username}")
+            print("Passwordless sudo enabled" if exit_status == 0 else "Failed to enable passwordless sudo")
         else:
             print("Passwordless sudo already enabled") 
 
-        shell.close()
-
     # initlialize the server object
-    if os_detected in os_supported["rhel"]["versions"]:
-        return RedhatServer(ssh_client, os_detected)
+    backend = find_backend(os_detected)
+    if backend is not None:
+        return backend(connection, os_detected, facts)
     else:
         print(f"\nUnsupported OS: {os_detected}\n")
-        ssh_client.close()
+        connection.close()
+        if not interactive:
+            # the caller (fleet mode) reports the host and carries on with the others
+            return None
         sys.exit(1)
\ No newline at end of file
@@ -3,7 +3,16 @@
 # Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
 
 import os
+import copy
 import json
+import tempfile
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 DEFAULT_CONFIG_ROOT  = os.path.expanduser("~/.creekside/linux_setup")
 DEFAULT_CONFIG_FILE  = os.path.join(DEFAULT_CONFIG_ROOT,"cfg/config.json")
@@ -13,10 +22,18 @@ DEFAULT_CONFIG = {
     "log": {
         "path": DEFAULT_LOG_PATH
     },
+    "ssh": {
+        "max_channels": 10,
+        "keepalive": 30,
+        "connect_deadline": 60
+    },
 }
 
 
 class GlobalConfig:
+    # Shared configuration store. Writes are atomic (temp file, fsync, rename)
+    # and serialized across processes with an advisory lock; changes made by
+    # other processes are picked up lazily when the file's mtime changes.
     _instance = None
 
     def __new__(cls, config_path=DEFAULT_CONFIG_FILE):
@@ -27,53 +44,150 @@ class GlobalConfig:
 
     def _initialize(self, config_path):
         self.config_path = os.path.expanduser(config_path)
+        self.lock_path   = self.config_path + ".lock"
+        self._lock       = threading.RLock()
+        self._pending    = None
+        self._mtime      = None
         config_dir = os.path.dirname(self.config_path)
         if not os.path.exists(config_dir):
-            os.makedirs(config_dir)
-        if os.path.exists(self.config_path):
-            # Load existing configuration
-            with open(self.config_path, 'r') as file:
-                self.config_data = json.load(file)
-        else:
-            # Initialize configuration with default values
-            self.config_data = DEFAULT_CONFIG.copy()
-            with open(self.config_path, 'w') as file:
-                json.dump(self.config_data, file, indent=4)
+            os.makedirs(config_dir, exist_ok=True)
 
-    def get(self, key, default=None):
-        keys = key.split()
-        subdict = self.config_data
-        for k in keys:
-            if isinstance(subdict, dict) and k in subdict:
-                subdict = subdict[k]
+        with self._file_lock():
+            if os.path.exists(self.config_path):
+                # Load existing configuration
+                self._reload_if_changed()
             else:
-                return default
-        return subdict
+                # Initialize configuration with default values
+                self.config_data = copy.deepcopy(DEFAULT_CONFIG)
+                self._write()
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.config_path, 'r') as file:
+            self.config_data = json.load(file)
+        self._mtime = mtime
+        # keep the changes of an open batch on top of the new content
+        for keys, value in self._pending or []:
+            self._apply(keys, value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._reload_if_changed()
+            keys = key.split()
+            subdict = self.config_data
+            for k in keys:
+                if isinstance(subdict, dict) and k in subdict:
+                    subdict = subdict[k]
+                else:
+                    return default
+            return subdict
 
     def search(self, path):
         #Check if a configuration path exists in the config_data dictionary
         #:param path: Configuration path
         #:return: True if the path exists, False otherwise
-        keys = path.split()
-        d = self.config_data
-        for key in keys:
-            if key in d:
-                d = d[key]
-            else:
-                return False
-        return True
+        with self._lock:
+            self._reload_if_changed()
+            keys = path.split()
+            d = self.config_data
+            for key in keys:
+                if isinstance(d, dict) and key in d:
+                    d = d[key]
+                else:
+                    return False
+            return True
     
     # Set a configuration value by key path, such as "log path"
     def set(self, key, value):
-        keys = key.split()
+        with self._lock:
+            keys = key.split()
+            self._apply(keys, value)
+            if self._pending is not None:
+                self._pending.append((keys, value))
+            else:
+                self._commit([(keys, value)])
+
+    # Coalesce all set() calls made inside the block into one atomic write:
+    #   with global_config.batch():
+    #       global_config.set("ssh_keys admin type", "ssh-ed25519")
+    #       global_config.set("ssh_keys admin key", "AAAA...")
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            if self._pending is not None:
+                # nested batch, the outermost one writes
+                yield self
+                return
+
+            self._pending = []
+            try:
+                yield self
+            except BaseException:
+                # drop the uncommitted changes
+                self._pending = None
+                self._mtime   = None
+                self._reload_if_changed()
+                raise
+            changes, self._pending = self._pending, None
+            if changes:
+                self._commit(changes)
+
+    def _apply(self, keys, value):
         config = self.config_data
         for k in keys[:-1]:
             if k not in config or not isinstance(config[k], dict):
                 config[k] = {}
             config = config[k]
         config[keys[-1]] = value
-        self._save_config()
+
+    def _commit(self, changes):
+        with self._file_lock():
+            # another process may have written since we last read the file
+            mtime = self._mtime
+            self._reload_if_changed()
+            if self._mtime != mtime:
+                for keys, value in changes:
+                    self._apply(keys, value)
+            self._write()
 
     def _save_config(self):
-        with open(self.config_path, 'w') as file:
-            json.dump(self.config_data, file, indent=4)
\ No newline at end of file
+        with self._lock:
+            self._commit([])
+
+    def _write(self):
+        config_dir = os.path.dirname(self.config_path)
+        fd, temp_path = tempfile.mkstemp(prefix=".config.", dir=config_dir)
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(self.config_data, file, indent=4)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.config_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        dir_fd = os.open(config_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._mtime = os.stat(self.config_path).st_mtime_ns
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Host inventory and run history in a local SQLite database: the hosts seen
+# with their detected facts, every settings run and the duration and outcome
+# of each step. Writes are queued and committed in batches, one transaction
+# per batch. The queries behind "linuxsetup.py --query" are at the bottom.
+
+import  os
+import  json
+import  time
+import  atexit
+import  sqlite3
+import  threading
+
+from    global_config                   import GlobalConfig, DEFAULT_CONFIG_ROOT
+from    tracing                         import get_tracer
+from    yum_progress                    import format_size
+
+DEFAULT_HISTORY_FILE = os.path.join(DEFAULT_CONFIG_ROOT, "history.db")
+HISTORY_BATCH_SIZE   = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hosts (
+    host        TEXT NOT NULL,
+    port        INTEGER NOT NULL,
+    os          TEXT,
+    hostname    TEXT,
+    public_ip   TEXT,
+    facts       TEXT,
+    first_seen  REAL,
+    last_seen   REAL,
+    initialized REAL,
+    PRIMARY KEY (host, port)
+);
+CREATE INDEX IF NOT EXISTS hosts_os ON hosts (os);
+CREATE TABLE IF NOT EXISTS runs (
+    id          TEXT PRIMARY KEY,
+    host        TEXT NOT NULL,
+    port        INTEGER NOT NULL,
+    mode        TEXT,
+    started     REAL,
+    duration    REAL,
+    status      TEXT,
+    failures    TEXT,
+    downloaded  REAL,
+    download_seconds REAL
+);
+CREATE INDEX IF NOT EXISTS runs_host ON runs (host, port, started);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id      TEXT NOT NULL,
+    host        TEXT NOT NULL,
+    name        TEXT NOT NULL,
+    description TEXT,
+    started     REAL,
+    duration    REAL,
+    outcome     TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_started ON steps (started, name);
+CREATE INDEX IF NOT EXISTS steps_run ON steps (run_id);
+"""
+
+# columns added to the runs table after the first release
+RUNS_COLUMNS = {"downloaded": "REAL", "download_seconds": "REAL"}
+
+# upsert that keeps first_seen and initialized of a known host
+UPSERT_HOST = """
+INSERT INTO hosts (host, port, os, hostname, public_ip, facts, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (host, port) DO UPDATE SET
+    os = excluded.os, hostname = excluded.hostname, public_ip = excluded.public_ip,
+    facts = excluded.facts, last_seen = excluded.last_seen
+"""
+
+class HistoryStore:
+    def __init__(self, path=None):
+        global_config   = GlobalConfig()
+        self.path       = os.path.expanduser(path or global_config.get("history path", DEFAULT_HISTORY_FILE))
+        self.batch_size = global_config.get("history batch_size", HISTORY_BATCH_SIZE)
+        self.lock       = threading.Lock()
+        self.db         = None
+        self.pending    = []
+        self.runs       = {}        # (host, port) -> id of its active run
+        self.counter    = 0
+
+    def _open(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            # concurrent runs of the tool share the file, readers don't block the writer
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.executescript(SCHEMA)
+            columns = {row[1] for row in self.db.execute("PRAGMA table_info(runs)")}
+            for column, kind in RUNS_COLUMNS.items():
+                if column not in columns:
+                    self.db.execute(f"ALTER TABLE runs ADD COLUMN {column} {kind}")
+        return self.db
+
+    def _queue(self, statement, params):
+        with self.lock:
+            self.pending.append((statement, params))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        # Commit the queued writes in one transaction
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return
+            db = self._open()
+            with db:
+                for statement, params in pending:
+                    db.execute(statement, params)
+
+    def record_host(self, host, port, os_name, facts):
+        now = time.time()
+        # the package list is large and kept by the facts cache already
+        kept = {key: value for key, value in facts.items() if key != "packages"}
+        kept["package_count"] = len(facts.get("packages") or [])
+        self._queue(UPSERT_HOST, (host, port, os_name, facts.get("hostname"), facts.get("public_ip"),
+                                  json.dumps(kept), now, now))
+
+    def begin_run(self, host, port, mode="steps"):
+        # Start a run of the settings steps, step spans of the host are recorded under it
+        with self.lock:
+            self.counter += 1
+            run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self.counter}"
+            self.runs[(host, port)] = run_id
+        self._queue("INSERT INTO runs (id, host, port, mode, started) VALUES (?, ?, ?, ?, ?)",
+                    (run_id, host, port, mode, time.time()))
+        return run_id
+
+    def end_run(self, run_id, status, failures, started, initialized=False):
+        # initialized: the host now has the settings applied
+        with self.lock:
+            for address, active in list(self.runs.items()):
+                if active == run_id:
+                    del self.runs[address]
+        self._queue("UPDATE runs SET duration = ?, status = ?, failures = ? WHERE id = ?",
+                    (time.time() - started, status, json.dumps(failures), run_id))
+        if initialized:
+            self._queue("UPDATE hosts SET initialized = ? WHERE (host, port) = (SELECT host, port FROM runs WHERE id = ?)",
+                        (time.time(), run_id))
+        # one transaction per run
+        self.flush()
+
+    def record_download(self, run_id, downloaded, seconds):
+        # Add a yum download to the run, its rate is compared across runs
+        self._queue("UPDATE runs SET downloaded = COALESCE(downloaded, 0) + ?, "
+                    "download_seconds = COALESCE(download_seconds, 0) + ? WHERE id = ?",
+                    (downloaded, seconds, run_id))
+
+    def previous_download_rate(self, host, port, run_id=None):
+        # Download rate in bytes/s of the latest other run of the host that downloaded, None if none did
+        rows = self.query("SELECT downloaded / download_seconds FROM runs WHERE host = ? AND port = ? AND id != ? "
+                          "AND download_seconds > 0 ORDER BY started DESC LIMIT 1", (host, port, run_id or ""))
+        return rows[0][0] if rows else None
+
+    def record_span(self, span):
+        # Tracer listener: steps of hosts with an active run, the spans carry host and port
+        if span.category != "step" or "step" not in span.attrs:
+            return
+        host = span.attrs.get("host")
+        with self.lock:
+            run_id = self.runs.get((host, span.attrs.get("port")))
+        if run_id is None:
+            return
+        outcome = span.attrs.get("outcome") or ("failed" if span.error else "ok")
+        self._queue("INSERT INTO steps (run_id, host, name, description, started, duration, outcome) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, host, span.attrs["step"], span.name, span.start, span.duration, outcome))
+
+    def query(self, statement, params=()):
+        self.flush()
+        with self.lock:
+            return self._open().execute(statement, params).fetchall()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+_store      = None
+_store_lock = threading.Lock()
+
+def get_history():
+    # The store of this process, None if disabled with "history enabled" = false
+    global _store
+    with _store_lock:
+        if _store is None and GlobalConfig().get("history enabled", True):
+            _store = HistoryStore()
+            get_tracer().add_listener(_store.record_span)
+            atexit.register(_store.close)
+        return _store
+
+# Queries
+
+def os_filter(os_name):
+    # "CentOS 7" matches "CentOS Linux 7": every word must appear
+    words = (os_name or "").split()
+    return " AND ".join(["os LIKE ?"] * len(words)) or "1", [f"%{word}%" for word in words]
+
+def query_hosts(store, os_name=None, initialized=None):
+    # (host, port, os, hostname, last_seen, initialized) rows
+    condition, params = os_filter(os_name)
+    if initialized is True:
+        condition += " AND initialized IS NOT NULL"
+    elif initialized is False:
+        condition += " AND initialized IS NULL"
+    return store.query(f"SELECT host, port, os, hostname, last_seen, initialized FROM hosts "
+                       f"WHERE {condition} ORDER BY host, port", params)
+
+def query_slowest_steps(store, days=30, limit=10):
+    # (name, runs, average, maximum, failures) of the steps that changed a host
+    return store.query("SELECT name, COUNT(*), AVG(duration), MAX(duration), SUM(outcome = 'failed') "
+                       "FROM steps WHERE started >= ? AND outcome IN ('done', 'failed') "
+                       "GROUP BY name ORDER BY AVG(duration) DESC LIMIT ?",
+                       (time.time() - days * 86400, limit))
+
+def query_runs(store, host=None, days=30, limit=50):
+    # (host, port, mode, started, duration, status, failures, download rate) of the latest runs
+    condition, params = "started >= ?", [time.time() - days * 86400]
+    if host:
+        condition += " AND host = ?"
+        params.append(host)
+    return store.query(f"SELECT host, port, mode, started, duration, status, failures, "
+                       f"CASE WHEN download_seconds > 0 THEN downloaded / download_seconds END FROM runs "
+                       f"WHERE {condition} ORDER BY started DESC LIMIT ?", params + [limit])
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp)) if timestamp else "-"
+
+def print_query(name, os_name=None, days=30, host=None):
+    # Print one of the --query reports, False if the name is unknown
+    store = get_history()
+    if store is None:
+        print("The run history is disabled (\"history enabled\" in the configuration)")
+        return False
+
+    if name in ("hosts", "initialized", "uninitialized"):
+        initialized = {"hosts": None, "initialized": True, "uninitialized": False}[name]
+        rows = query_hosts(store, os_name, initialized)
+        print(f"\n o Hosts ({len(rows)})")
+        print(f"   {'Host':<30} {'OS':<20} {'Last seen':<16} {'Initialized':<16}")
+        print(f"   {'-' * 30} {'-' * 20} {'-' * 16} {'-' * 16}")
+        for host_name, port, os_detected, hostname, last_seen, initialized in rows:
+            address = host_name if port == 22 else f"{host_name}:{port}"
+            print(f"   {address[:30]:<30} {(os_detected or '-')[:20]:<20} {format_time(last_seen):<16} "
+                  f"{format_time(initialized):<16}")
+    elif name == "slowest-steps":
+        rows = query_slowest_steps(store, days)
+        print(f"\n o Slowest steps over the last {days} days")
+        print(f"   {'Step':<20} {'Runs':>6} {'Avg s':>8} {'Max s':>8} {'Failed':>7}")
+        print(f"   {'-' * 20} {'-' * 6} {'-' * 8} {'-' * 8} {'-' * 7}")
+        for step, runs, average, maximum, failed in rows:
+            print(f"   {step[:20]:<20} {runs:>6} {average:>8.2f} {maximum:>8.2f} {failed:>7}")
+    elif name == "runs":
+        rows = query_runs(store, host, days)
+        print(f"\n o Runs over the last {days} days")
+        print(f"   {'Host':<30} {'Mode':<6} {'Started':<16} {'Duration':>9} {'Download':>10}  {'Status':<8} Failures")
+        print(f"   {'-' * 30} {'-' * 6} {'-' * 16} {'-' * 9} {'-' * 10}  {'-' * 8} {'-' * 20}")
+        for host_name, port, mode, started, duration, status, failures, rate in rows:
+            address = host_name if port == 22 else f"{host_name}:{port}"
+            failures = "; ".join(json.loads(failures or "[]")) or "-"
+            duration = f"{duration:>8.1f}s" if duration is not None else f"{'-':>9}"
+            rate     = f"{format_size(rate)}/s" if rate else "-"
+            print(f"   {address[:30]:<30} {mode or '-':<6} {format_time(started):<16} {duration} {rate:>10}  "
+                  f"{status or 'running':<8} {failures}")
+    else:
+        return False
+    return True
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Output capture: every remote command's output is streamed to a per-host,
+# per-run log file under "<log path>/hosts/<host>_<port>/", written through a
+# large buffer and rotated by size into gzip-compressed segments. Callers keep
+# only a bounded RingBuffer of the most recent output for error reporting.
+
+import  os
+import  gzip
+import  time
+import  atexit
+import  shutil
+import  threading
+import  collections
+
+from    global_config                   import GlobalConfig, DEFAULT_LOG_PATH
+
+DEFAULT_MAX_BYTES   = 10 * 1024 * 1024     # per log segment
+DEFAULT_BACKUPS     = 5                    # compressed segments kept per run
+DEFAULT_RUNS        = 20                   # run logs kept per host
+DEFAULT_TAIL_SIZE   = 16 * 1024            # characters kept by RingBuffer
+LOG_BUFFER_SIZE     = 1024 * 1024
+
+class RingBuffer:
+    # The most recent max_chars characters of a command's output
+    def __init__(self, max_chars=DEFAULT_TAIL_SIZE):
+        self.max_chars = max_chars
+        self.chunks    = collections.deque()
+        self.size      = 0
+        self.dropped   = 0
+
+    def append(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        while self.size > self.max_chars:
+            head = self.chunks.popleft()
+            excess = self.size - self.max_chars
+            if len(head) > excess:
+                # keep the end of a chunk that is only partly out of range
+                self.chunks.appendleft(head[excess:])
+                head = head[:excess]
+            self.size    -= len(head)
+            self.dropped += len(head)
+
+    def text(self):
+        return "".join(self.chunks)
+
+    def lines(self, count=10):
+        return self.text().splitlines()[-count:]
+
+class HostLog:
+    def __init__(self, hostname, port=22, path=None):
+        global_config  = GlobalConfig()
+        log_path       = path or global_config.get("log path", DEFAULT_LOG_PATH)
+        self.directory = os.path.join(os.path.expanduser(log_path), "hosts", f"{hostname}_{port}")
+        self.max_bytes = global_config.get("log max_bytes", DEFAULT_MAX_BYTES)
+        self.backups   = global_config.get("log backups", DEFAULT_BACKUPS)
+        self.path      = os.path.join(self.directory, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}.log")
+        self.lock      = threading.Lock()
+        self.file      = None
+        self.size      = 0
+        self.counter   = 0
+        self.writer    = None
+        self._expire(global_config.get("log runs", DEFAULT_RUNS))
+
+    def _expire(self, runs):
+        # Remove the oldest run logs of the host, with their segments
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        logs = sorted(name for name in names if name.endswith(".log"))
+        for name in logs[:max(0, len(logs) - runs + 1)]:
+            for other in names:
+                if other == name or other.startswith(name + "."):
+                    try:
+                        os.remove(os.path.join(self.directory, other))
+                    except OSError:
+                        pass
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.file = open(self.path, "ab", buffering=LOG_BUFFER_SIZE)
+        self.size = self.file.tell()
+
+    def _rotate(self):
+        # <run>.log -> <run>.log.1.gz, older segments move up by one
+        self.file.close()
+        self.file = None
+        for index in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{index}.gz"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}.gz")
+        if self.backups > 0:
+            with open(self.path, "rb") as source, gzip.open(f"{self.path}.1.gz.tmp", "wb") as target:
+                shutil.copyfileobj(source, target, LOG_BUFFER_SIZE)
+            os.replace(f"{self.path}.1.gz.tmp", f"{self.path}.1.gz")
+        os.remove(self.path)
+        self._open()
+
+    def _write(self, text):
+        if self.file is None:
+            self._open()
+        data = text.encode('utf-8', errors='replace')
+        if self.size and self.size + len(data) > self.max_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.size += len(data)
+
+    def begin(self, command):
+        # Start a command record, returns its id for write() and end()
+        with self.lock:
+            self.counter += 1
+            self.writer = self.counter
+            self._write(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] #{self.counter} $ {command}\n")
+            return self.counter
+
+    def write(self, command_id, text):
+        with self.lock:
+            if self.writer != command_id:
+                # commands of concurrent steps interleave, mark where each continues
+                self.writer = command_id
+                self._write(f"\n--- #{command_id} ---\n")
+            self._write(text)
+
+    def end(self, command_id, exit_status, seconds):
+        with self.lock:
+            self._write(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] #{command_id} exit {exit_status} ({seconds:.1f}s)\n")
+            self.writer = None
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+_logs      = {}
+_logs_lock = threading.Lock()
+
+def get_host_log(hostname, port=22):
+    # The log of this run for the host, shared by all its commands
+    with _logs_lock:
+        log = _logs.get((hostname, port))
+        if log is None:
+            log = _logs[(hostname, port)] = HostLog(hostname, port)
+        return log
+
+def close_host_logs():
+    with _logs_lock:
+        for log in _logs.values():
+            log.close()
+
+atexit.register(close_host_logs)
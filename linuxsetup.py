@@ -4,12 +4,11 @@
 
 import  os
 import  sys
+import  atexit
 import  argparse
-import  paramiko
-from    simple_term_menu                import TerminalMenu
-from    getpass                         import getpass
 
-from    get_server                      import get_server
+# paramiko, simple_term_menu and the OS backends are imported where they are
+# used, so --help and argument errors start instantly
 
 TITLE_COPYRIGHT="""
 ***************************************************************************
@@ -19,36 +18,119 @@ TITLE_COPYRIGHT="""
 
 """
 
-# Function to connect to the Linux server
-def connect_ssh(hostname, port, username, passwd):
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    
-    while True:
-        try:
-            if passwd is None:
-                passwd = getpass(f"Password: ")
-            client.connect(hostname, port=port, username=username, password=passwd)
-            print(f"Connected to {hostname} on port {port}")
-            return client
-        except Exception as sshException:
-            print(f"\n{sshException}, please try again\n")
-            hostname = input(f"Hostname/IP [{hostname}]: ") or hostname
-            port     = input(f"Port [{port}]: ")
-            port     = int(port) if port else 22
-            username = input(f"Username [{username}]: ") or username
-            passwd   = None
+# Unattended mode, all settings are validated before any remote work starts
+def unattended(args):
+    from answers import Answers, AnswersError, host_address
+    from fleet   import read_inventory, parse_host, initialize_host, print_summary, run_fleet
+
+    try:
+        answers = Answers.load(args.answers) if args.answers else Answers({})
+    except (OSError, ValueError) as e:
+        print(f"Failed to load answers file: {e}")
+        return False
+
+    # command line options override the defaults of the answers file
+    defaults = answers.data.setdefault("defaults", {})
+    if args.timezone:
+        defaults["timezone"] = args.timezone
+    if args.ssh_key:
+        defaults["ssh_keys"] = args.ssh_key
+
+    if args.fleet:
+        hosts = read_inventory(args.fleet, port=args.p)
+        for entry in hosts:
+            # hostname and timezone columns of the inventory take precedence
+            address      = host_address(entry["host"], entry["port"])
+            host_answers = answers.data.setdefault("hosts", {}).setdefault(address, {})
+            if entry["new_hostname"]:
+                host_answers["hostname"] = entry["new_hostname"]
+            if entry["timezone"]:
+                host_answers["timezone"] = entry["timezone"]
+    elif args.hostname:
+        username, hostname = args.hostname.split('@', 1) if '@' in args.hostname else (None, args.hostname)
+        hosts = [{"host": hostname, "port": args.p, "username": username}]
+    else:
+        hosts = [parse_host(host, port=args.p) for host in answers.hosts()]
+        hosts = [{"host": host, "port": port, "username": username} for host, port, username in hosts]
+
+    if not hosts:
+        print("No hosts to initialize")
+        return False
+
+    try:
+        resolved = answers.validate([(entry["host"], entry["port"]) for entry in hosts])
+    except AnswersError as e:
+        print(e)
+        return False
+
+    rpm_cache = None
+    if args.rpm_cache:
+        from rpm_cache import RpmCache
+        rpm_cache = RpmCache()
+        if not rpm_cache.available():
+            print("The RPM cache needs createrepo_c (or createrepo) on this machine, continuing without it")
+            rpm_cache = None
+
+    try:
+        if len(hosts) > 1 or args.fleet:
+            return run_fleet(hosts, resolved, password=args.w, workers=max(1, args.jobs), plan=args.plan, rpm_cache=rpm_cache,
+                             script=args.script, profile=args.profile)
+
+        entry  = hosts[0]
+        result = initialize_host(entry, resolved[(entry["host"], entry["port"])], password=args.w, plan=args.plan,
+                                 rpm_cache=rpm_cache, script=args.script, profile=args.profile)
+        print_summary([result])
+        return result["status"] in ("ok", "pending")
+    finally:
+        if rpm_cache is not None:
+            rpm_cache.close()
+
+# Import what a typical run needs so --startup-profile can report cold start times
+def load_modules():
+    import paramiko
+    import simple_term_menu
+    import get_server
+    import fleet
+    import answers
+    from backends import os_supported, find_backend
+    for family in os_supported.values():
+        if family["backend"]:
+            find_backend(family["versions"][0])
 
 # main function
 def main():
+    if '--startup-profile' in sys.argv:
+        from startup_profile import ImportProfiler
+        profiler = ImportProfiler()
+        profiler.install()
+        atexit.register(profiler.report)
+
+    from fleet import DEFAULT_WORKERS
+
     # print copyright information
     print(TITLE_COPYRIGHT)
 
     # parse command line arguments
     parser = argparse.ArgumentParser(description='Connect to a Linux server')
-    parser.add_argument('hostname', help='The hostname or IP address of the server (optionally with username@hostname)')
-    parser.add_argument('-p', type=int, default=22, help='Specify a port other than the default port 22')
+    parser.add_argument('hostname', nargs='?', help='The hostname or IP address of the server (optionally with username@hostname)')
+    parser.add_argument('-p', type=int, default=None, help='Specify a port other than the default port 22 (or the one in ~/.ssh/config)')
     parser.add_argument('-w', type=str, default=None, help='Password for the user')
+    parser.add_argument('-f', '--fleet', metavar='INVENTORY', help='Initialize all hosts listed in the inventory file concurrently')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_WORKERS, help=f'Number of hosts initialized at the same time in fleet mode (default {DEFAULT_WORKERS})')
+    parser.add_argument('-a', '--answers', metavar='FILE', help='Run unattended with settings from a YAML/JSON answers file')
+    parser.add_argument('--rpm-cache', action='store_true', help='Unattended mode: serve RPMs downloaded by the first host to the others from a controller cache')
+    parser.add_argument('--script', action='store_true', help='Apply the setup steps as one script run in a single round trip per host')
+    parser.add_argument('--plan', action='store_true', help='Unattended mode: only list the changes that would be made')
+    parser.add_argument('--timezone', help='Timezone applied in unattended mode (default: detected per host)')
+    parser.add_argument('--ssh-key', action='append', default=[], help='Name of a stored ssh key to add in unattended mode (repeatable)')
+    parser.add_argument('--profile', help='SSH transport profile, e.g. lan or wan (default: "ssh profile" in the configuration)')
+    parser.add_argument('--measure', type=int, nargs='?', const=32, metavar='MB',
+                        help='Measure throughput and controller CPU of the transport profiles (or --profile) against the host')
+    parser.add_argument('--query', choices=['hosts', 'initialized', 'uninitialized', 'slowest-steps', 'runs'],
+                        help='Report from the local host inventory and run history instead of connecting')
+    parser.add_argument('--os', help='Limit --query hosts reports to an OS, e.g. "CentOS 7"')
+    parser.add_argument('--days', type=int, default=30, help='Period of the --query slowest-steps and runs reports (default 30)')
+    parser.add_argument('--startup-profile', action='store_true', help='Report the import time of every module on exit')
 
     if len(sys.argv) == 1:
         parser.print_help()
@@ -56,18 +138,54 @@ def main():
 
     args  = parser.parse_args()
 
+    # print the slowest steps and write the trace files when the run ends
+    from tracing import get_tracer
+    atexit.register(get_tracer().finish)
+
+    if args.startup_profile and not (args.hostname or args.fleet or args.answers):
+        load_modules()
+        sys.exit(0)
+
+    if args.query:
+        from history import print_query
+        sys.exit(0 if print_query(args.query, args.os, args.days, args.hostname) else 1)
+
+    if args.profile:
+        from connection import transport_profile
+        try:
+            transport_profile(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.fleet or args.answers or args.plan or args.rpm_cache:
+        sys.exit(0 if unattended(args) else 1)
+
+    if not args.hostname:
+        parser.error("the hostname is required unless --fleet is given")
+
     # Extract username and hostname
     if '@' in args.hostname:
         username, hostname = args.hostname.split('@', 1)
     else:
-        username = "root"
+        username = None
         hostname = args.hostname
 
-    # Use default password "ubnt" if username is "ubnt"
-    port  = args.p if args.p is not None else 22
-    passwd = args.w if args.w is not None else None
+    # port and user default to ~/.ssh/config, then 22 and root
+    port   = args.p
+    passwd = args.w
 
-    server = get_server(hostname, port, username, passwd)
+    if args.measure:
+        from transport_measure import measure_profiles
+        results = measure_profiles(hostname, port, username, passwd, [args.profile] if args.profile else None,
+                                   args.measure * 1024 * 1024)
+        sys.exit(0 if results else 1)
+
+    from get_server       import get_server
+    from simple_term_menu import TerminalMenu
+
+    server = get_server(hostname, port, username, passwd, profile=args.profile)
+    if args.script:
+        server.script_mode = True
 
     title="\no Main menu"
     options = [
@@ -76,6 +194,10 @@ def main():
         "[2] Install applications", 
     ]
 
+    # keep the host busy with lookups while the menu waits for the operator,
+    # once per connection: results that were taken are fetched again on demand
+    server.start_prefetch()
+
     while True:
         terminal_menu       = TerminalMenu(options, title=title)
         menu_entry_index    = terminal_menu.show()
@@ -88,6 +210,7 @@ def main():
             case _:
                 print("\n*** This feature is not implemented yet")
 
+    server.stop_prefetch()
     server.close()
     print("\n*** Thank you for using this script ***\n\n")
 
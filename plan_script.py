@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Single round trip execution: the selected steps are compiled into one
+# self-contained shell script that is run as root with one exec. The script
+# prints "@@LS <event> <step> ..." marker lines, which are rendered with the
+# usual print_status output while everything else goes to the host log.
+
+import  codecs
+import  shlex
+
+from    remote_file                     import SetKeyValue
+from    server                          import print_status
+from    tracing                         import span
+
+MARKER = "@@LS"
+
+SCRIPT_HEADER = r'''set -u
+ls_failed=" "
+ls_detail() { echo "@@LS detail $ls_step $*"; }
+ls_run() {
+    ls_step=$1; shift
+    for ls_required in "$@"; do
+        case "$ls_failed" in *" $ls_required "*)
+            ls_failed="$ls_failed$ls_step "
+            echo "@@LS end $ls_step skipped"
+            return ;;
+        esac
+    done
+    echo "@@LS start $ls_step"
+    if ( check_$ls_step ) > /dev/null 2>&1 < /dev/null; then
+        echo "@@LS end $ls_step ok"
+    elif ( apply_$ls_step ) < /dev/null 2>&1; then
+        echo "@@LS end $ls_step done"
+    else
+        ls_failed="$ls_failed$ls_step "
+        echo "@@LS end $ls_step failed"
+    fi
+}
+'''
+
+def ere(pattern):
+    # Python regex to POSIX ERE for the small subset used by the steps
+    converted = pattern.replace(r"\s", "[[:space:]]")
+    if "\\" in converted:
+        raise ValueError(f"cannot convert {pattern!r} to a POSIX regex")
+    return converted
+
+def ere_literal(text):
+    return "".join(char if char.isalnum() or char in "_-" else f"[{char}]" for char in text)
+
+def set_key_value_awk(edit):
+    # awk filter with the same result as SetKeyValue.apply: the first active
+    # line wins, a "#key" directive is only used when there is none
+    separator = edit.separator.strip()
+    if separator:
+        tail = f"{ere_literal(edit.key)}[[:space:]]*{ere_literal(separator)}"
+    else:
+        tail = f"{ere_literal(edit.key)}([[:space:]]|$)"
+    wanted = f"{edit.key}{edit.separator}{edit.value}"
+    if "\\" in wanted:
+        raise ValueError(f"cannot pass {wanted!r} to awk")
+    before = ere(edit.before.pattern) if edit.before is not None else ""
+    program = (
+        '{ out[++n] = $0 } '
+        '$0 ~ a { if (!fa) fa = n; else drop[n] = 1 } '
+        '$0 ~ c && !fc { fc = n } '
+        'END { i = n + 1; '
+        'if (fa) out[fa] = w; else if (fc) out[fc] = w; '
+        'else if (b != "") for (j = 1; j <= n; j++) if (out[j] ~ b) { i = j; break } '
+        'for (j = 1; j <= n; j++) { if (j == i) print w; if (!(j in drop)) print out[j] } '
+        'if (i > n && !fa && !fc) print w }'
+    )
+    return (f"awk -v a={shlex.quote('^[[:space:]]*' + tail)} -v c={shlex.quote('^[[:space:]]*#' + tail)} "
+            f"-v w={shlex.quote(wanted)} -v b={shlex.quote(before)} {shlex.quote(program)}")
+
+def file_script(path, edits, backup=True):
+    # (check, apply) shell for a file edit step; ValueError if an edit can't be compiled
+    filters = []
+    for edit in edits:
+        if not isinstance(edit, SetKeyValue):
+            raise ValueError(f"{type(edit).__name__} has no shell form")
+        filters.append(set_key_value_awk(edit))
+    quoted = shlex.quote(path)
+    edited = f"{filters[0]} {quoted}" + "".join(f" | {command}" for command in filters[1:])
+    check = f"{edited} | cmp -s - {quoted}"
+    apply = " && ".join(([f"cp -p {quoted} {quoted}.bak"] if backup else []) + [
+        f"{edited} > {quoted}.new",
+        f"chmod --reference={quoted} {quoted}.new",
+        f"chown --reference={quoted} {quoted}.new",
+        f"mv -f {quoted}.new {quoted}",
+    ])
+    return check, apply
+
+def compile_steps(steps, username):
+    # One script for the steps, which must all carry a .script (check, apply) pair.
+    # $LS_USER and $LS_HOME name the login user for steps that touch its files.
+    lines = ["#!/bin/sh", f"# linuxsetup plan for {len(steps)} steps", SCRIPT_HEADER,
+             f"LS_USER={shlex.quote(username)}",
+             'LS_HOME=$(getent passwd "$LS_USER" | cut -d: -f6)', ""]
+    index = {step.name: number for number, step in enumerate(steps)}
+    for number, step in enumerate(steps):
+        check, apply = step.script
+        lines += [f"# {step.description}",
+                  f"check_{number}() {{\n    {check}\n}}",
+                  f"apply_{number}() {{\n    {apply}\n}}"]
+    lines.append("")
+    for number, step in enumerate(steps):
+        requires = " ".join(str(index[name]) for name in step.requires if name in index)
+        lines.append(f"ls_run {number} {requires}".rstrip())
+    lines += ["", 'case "$ls_failed" in " ") exit 0 ;; esac', "exit 1", ""]
+    return "\n".join(lines)
+
+def run_script_steps(connection, steps, journal=None, host=None, port=None):
+    # Run the steps with one exec, returns the failed step descriptions
+    failures = []
+    selected = []
+    reported = set()        # steps the script reported an outcome for
+    for step in steps:
+        if journal is not None and journal.is_completed(step):
+            print_status(step.description, "done (journal)")
+        else:
+            selected.append(step)
+    if not selected:
+        if journal is not None:
+            journal.finish()
+        return failures
+
+    script  = compile_steps(selected, connection.username)
+    command = "sh -s" if connection.username == "root" else "sudo -n sh -s"
+    state   = {"pending": "", "step": None, "trace": None}
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+    def finish(step, status):
+        reported.add(step.description)
+        trace = state["trace"]
+        if trace is not None:
+            trace.exit_code = 0 if status in ("ok", "done") else 1
+            trace.attrs["outcome"] = status
+            trace.__exit__(None, None, None)
+            state["trace"] = None
+        if state["step"] is step:
+            print(status)
+        else:
+            print_status(step.description, status)
+        for line in step.details:
+            print(f"     > {line}")
+        state["step"] = None
+        if status in ("ok", "done"):
+            if journal is not None:
+                journal.mark(step)
+        else:
+            failures.append(step.description)
+
+    def marker(line):
+        fields = line.split(" ", 3)
+        if len(fields) < 3 or not fields[2].isdigit() or int(fields[2]) >= len(selected):
+            return
+        step = selected[int(fields[2])]
+        if fields[1] == "start":
+            step.details.clear()
+            state["step"] = step
+            state["trace"] = span(step.description, "step", host=host, port=port, mode="script",
+                                  step=step.name).__enter__()
+            print_status(step.description)
+        elif fields[1] == "detail" and len(fields) > 3:
+            step.details.append(fields[3])
+        elif fields[1] == "end" and len(fields) > 3:
+            finish(step, fields[3].strip())
+
+    def output(data):
+        text = state["pending"] + decoder.decode(data)
+        lines = text.split("\n")
+        state["pending"] = lines.pop()
+        for line in lines:
+            if line.startswith(MARKER + " "):
+                marker(line.rstrip("\r"))
+
+    result = connection.exec(command, input=script, timeout=0, callback=output)
+    output(b"\n")
+
+    if state["step"] is not None:
+        finish(state["step"], "failed")
+    if result.exit_code is None or (result.exit_code != 0 and not failures):
+        # the script did not run to the end, e.g. sudo needs a password
+        for step in selected:
+            if step.description not in reported:
+                failures.append(step.description)
+        if result.error_text.strip():
+            print(f"     > {result.error_text.strip().splitlines()[-1]}")
+
+    if journal is not None and not failures:
+        journal.finish()
+    return failures
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Speculative background work. Side-effect free remote lookups are started
+# while the operator is busy with a menu or a prompt, so the results are
+# ready when the answers are. Work the answers made irrelevant is cancelled.
+
+import  threading
+
+from    concurrent.futures              import ThreadPoolExecutor
+
+DEFAULT_PREFETCH_WORKERS = 4
+
+class Prefetcher:
+    def __init__(self, workers=DEFAULT_PREFETCH_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.tasks    = {}
+        self.lock     = threading.Lock()
+
+    def submit(self, name, func):
+        # func(cancel) runs in the background, cancel is a threading.Event it
+        # should pass on to long remote commands (see SSHConnection.exec)
+        cancel = threading.Event()
+        with self.lock:
+            self.tasks[name] = (self.executor.submit(func, cancel), cancel)
+
+    def take(self, name, timeout=None):
+        # Wait for a task and hand out its result once; None if the task was
+        # not started, failed or was cancelled, the caller then does the work itself
+        with self.lock:
+            future, cancel = self.tasks.pop(name, (None, None))
+        if future is None or cancel.is_set():
+            return None
+        try:
+            return future.result(timeout)
+        except Exception:
+            return None
+
+    def peek(self, name, timeout=None):
+        # Like take(), but the result stays available
+        with self.lock:
+            future, cancel = self.tasks.get(name, (None, None))
+        if future is None or cancel.is_set():
+            return None
+        try:
+            return future.result(timeout)
+        except Exception:
+            return None
+
+    def cancel(self, name):
+        with self.lock:
+            future, cancel = self.tasks.pop(name, (None, None))
+        if future is not None:
+            cancel.set()
+            future.cancel()
+
+    def close(self):
+        with self.lock:
+            names = list(self.tasks)
+        for name in names:
+            self.cancel(name)
+        self.executor.shutdown(wait=False)
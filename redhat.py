@@ -3,61 +3,214 @@
 # Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
 
 import  os
+import  re
 import  json
+import  shlex
 import  time
-import  pytz
-import  requests
 
 from    global_config       import GlobalConfig
-from    server              import server_run_cmd
-from    sshkey              import retrieve_ssh_key
-
-def print_status(msg, status=None):
-    if status == None:
-        print(f"   - {msg:<40} : ", end="")
-    else:
-        print(f"   - {msg:<40} : {status}")
+from    timezones           import is_valid_timezone
+from    server              import server_run_cmd, print_status
+from    steps               import Step, Journal, plan_steps, apply_steps, DEFAULT_STEP_WORKERS
+from    tracing             import span
+from    host_log            import get_host_log
+from    yum_progress        import YumProgress, format_size
+from    prefetch            import Prefetcher
+from    sshkey              import retrieve_ssh_key, merge_authorized_keys
+from    facts               import get_facts, invalidate_facts
+from    history             import get_history
+from    geolocation         import get_resolver
+from    remote_file         import SetKeyValue, apply_edits, content_hash, read_remote_file, write_remote_file
+from    plan_script         import file_script, run_script_steps
+
+DEFAULT_PACKAGES = [
+    "yum-utils","rsync","util-linux","curl","firewalld","bind-utils","telnet","jq","nano",
+    "ed","tcpdump","wget","nfs-utils","cifs-utils","samba-client","tree","xterm","net-tools",
+    "openldap-clients","sssd","realmd","oddjob","oddjob-mkhomedir","adcli",
+    "samba-common","samba-common-tools","krb5-workstation","iperf3","rsnapshot","zip",
+    "unzip","ftp","autofs","zsh","ksh","tcsh","ansible","cabextract","fontconfig",
+    "nedit","htop","tar","traceroute","mtr","pwgen","ipa-admintools"]
+
+# a missing file reads as empty, any other failure must not
+READ_AUTHORIZED_KEYS = "[ -e ~/.ssh/authorized_keys ] || exit 0; cat ~/.ssh/authorized_keys"
+
+# dnf.conf settings applied by the dnf_speed step. Their effect shows in the
+# download rate of the packages steps, which is kept per run in the history
+# and compared against the previous run of the host.
+DNF_SPEED_SETTINGS = [
+    ("max_parallel_downloads", "10"),
+    ("fastestmirror", "True"),
+    ("keepcache", "True"),
+]
 
 def get_ip_info(ip_address):
-
-    response = requests.get(f"https://ipinfo.io/{ip_address}/json")
-    if response.status_code == 200:
-        info = response.json()
-        city = info.get('city')
-        region = info.get('region')
-        country = info.get('country')
-        timezone = info.get('timezone')
-        return timezone, city, region, country
-    else:
-        return None
+    # Returns (timezone, city, region, country), all None if the lookup fails
+    try:
+        info = get_resolver().lookup(ip_address)
+    except ValueError:
+        info = None
+    if not info:
+        return None, None, None, None
+    return info.get('timezone'), info.get('city'), info.get('region'), info.get('country')
 
 #
 class RedhatServer:
-    def __init__(self, ssh_client, os_name):
-        self.ssh_client = ssh_client
+    def __init__(self, connection, os_name, facts=None):
+        self.connection = connection
         self.os         = os_name
-
-    def run_cmd(self, command):
-        stdin, stdout, stderr = self.ssh_client.exec_command(command)
-        return stdout.read().decode('utf-8')
+        self.facts      = facts or {}
+        self.installed_packages = set(self.facts["packages"]) if self.facts.get("packages") else None
+        self.rpm_cache  = None
+        self.last_download = {}
+        self.prefetch   = None
+        self.history_run = None     # id of the running apply_settings run in the history
+        # run the settings steps as one compiled script, see plan_script.py
+        self.script_mode = GlobalConfig().get("steps script", False)
+
+    def run_cmd(self, command, input=None, timeout=60, cancel=None, pty=False):
+        # Returns a connection.ExecResult
+        return self.connection.exec(command, input=input, timeout=timeout, cancel=cancel, pty=pty)
+
+    def run_root(self, command, timeout=30):
+        # Run a command on the persistent root shell, returns (exit_status, output)
+        return self.connection.get_root_shell().run(command, timeout)
 
     def run_interactive_cmd(self, command, echo=False, progress=False, timeout=30):
-        return server_run_cmd(self.ssh_client, command, echo=echo, progress=progress, timeout=timeout)
+        return server_run_cmd(self.connection, command, echo=echo, progress=progress, timeout=timeout)
+
+    def refresh_packages(self, packages=None):
+        # Without arguments take a full snapshot of installed package names,
+        # otherwise re-query only the given packages and update the snapshot
+        if packages is None or self.installed_packages is None:
+            result = (self.prefetch and self.prefetch.take("packages")) or self.run_cmd("rpm -qa --qf '%{NAME}\\n'")
+            if not result.ok:
+                raise RuntimeError(f"rpm -qa failed: {result.error_text.strip()}")
+            self.installed_packages = set(result.text.split())
+            return self.installed_packages
+
+        packages = list(packages)
+        if packages:
+            # installed packages are printed with a marker, so the (localized)
+            # messages for missing ones and the exit code can be ignored
+            output = self.run_cmd("rpm -q --qf '@@ %{NAME}\\n' " + " ".join(packages)).text
+            found = {line[3:].strip() for line in output.splitlines() if line.startswith("@@ ")}
+            for package in packages:
+                if package in found:
+                    self.installed_packages.add(package)
+                else:
+                    self.installed_packages.discard(package)
+        return self.installed_packages
 
     def is_package_installed(self, package):
-        stdin, stdout, stderr = self.ssh_client.exec_command(f"rpm -q {package}")
-        output = stdout.read().decode('utf-8')
-        return "is not installed" not in output
+        if self.installed_packages is None:
+            self.refresh_packages()
+        return package in self.installed_packages
 
     def install_package(self, package):
-        if self.is_package_installed(package):
-            print_status(f"Installing {package}", "done")
-        else:
-            print_status(f"Installing {package}")
-            self.run_interactive_cmd(f"sudo yum install -y {package}", echo=False, progress=True, timeout=0)
-            print("done")
-
-    def os_initialization(self):
+        self.install_packages([package])
+
+    def install_packages(self, packages, verbose=True, progress=None):
+        # progress: callable receiving the progress bar text when not verbose,
+        #           e.g. Step.progress
+        # dedupe while keeping the requested order
+        packages = list(dict.fromkeys(packages))
+        if self.installed_packages is None:
+            self.refresh_packages()
+
+        missing = [package for package in packages if package not in self.installed_packages]
+        if missing:
+            # install all missing packages in a single yum/dnf transaction
+            with span(f"Installing {len(missing)} packages", "step", host=self.connection.hostname,
+                      port=self.connection.port) as trace:
+                if verbose:
+                    print_status(f"Installing {len(missing)} packages")
+                exit_status, _ = self.install_with_cache(f"sudo yum install -y {' '.join(missing)}",
+                                                         progress=verbose or progress)
+                trace.attrs.update(self.last_download)
+                self.refresh_packages(missing)
+                ok = exit_status == 0 and all(package in self.installed_packages for package in missing)
+                trace.exit_code = 0 if ok else 1
+                if verbose:
+                    print("done" if ok else "failed")
+
+        if verbose:
+            for package in packages:
+                status = "done" if package in self.installed_packages else "failed"
+                print_status(f"Installing {package}", status)
+
+        return [package for package in missing if package not in self.installed_packages]
+
+    def record_download(self, download):
+        # Keep the download rate in the history run and describe it against the
+        # previous run of the host, which shows the effect of the dnf speed settings
+        text = f"Downloaded {format_size(download['downloaded'])} at {format_size(download['rate'])}/s"
+        history = get_history()
+        if history is None or self.history_run is None:
+            return text
+        previous = history.previous_download_rate(self.connection.hostname, self.connection.port, self.history_run)
+        history.record_download(self.history_run, download["downloaded"], download["seconds"])
+        if previous:
+            text += f", {(download['rate'] / previous - 1) * 100:+.0f}% against the previous run ({format_size(previous)}/s)"
+        return text
+
+    def run_yum(self, command, progress=True):
+        # Run a yum/dnf transaction with a progress bar, the download
+        # statistics are kept in self.last_download. progress: True draws the
+        # bar, a callable receives its text instead
+        tracker = YumProgress(render=progress is True, callback=progress if callable(progress) else None)
+        try:
+            return server_run_cmd(self.connection, command, timeout=0, callback=tracker.feed)
+        finally:
+            tracker.clear()
+            self.last_download = tracker.summary()
+
+    def install_with_cache(self, command, progress=True):
+        # Run a yum transaction, using and feeding the controller RPM cache if enabled
+        if self.rpm_cache is None:
+            return self.run_yum(command, progress)
+
+        attached = self.rpm_cache.attach(self)
+        try:
+            result = self.run_yum(command.replace("yum ", "yum --setopt=keepcache=1 ", 1), progress)
+        finally:
+            if attached:
+                self.rpm_cache.detach(self)
+        self.rpm_cache.collect(self)
+        return result
+
+    def start_prefetch(self):
+        # Start side-effect free remote work in the background while the
+        # operator is at the menu or the prompts; os_initialization picks
+        # up the results and cancels what the answers made irrelevant
+        if self.prefetch is not None:
+            return
+        self.prefetch = prefetch = Prefetcher()
+
+        def facts(cancel):
+            return self.facts or get_facts(self.connection)
+
+        def geolocation(cancel):
+            ip_address = (prefetch.peek("facts") or {}).get("public_ip")
+            return get_ip_info(ip_address) if ip_address else None
+
+        prefetch.submit("facts", facts)
+        prefetch.submit("geolocation", geolocation)
+        if self.installed_packages is None:
+            prefetch.submit("packages", lambda cancel: self.run_cmd("rpm -qa --qf '%{NAME}\\n'", cancel=cancel))
+        prefetch.submit("authorized_keys", lambda cancel: self.run_cmd(READ_AUTHORIZED_KEYS, cancel=cancel))
+        # refreshes only the metadata cache, the package steps then start without it.
+        # On a pty, so cancelling hangs up yum and releases its lock on the host.
+        prefetch.submit("makecache", lambda cancel: self.run_cmd("sudo yum makecache -q", timeout=0, cancel=cancel,
+                                                                 pty=True))
+
+    def stop_prefetch(self):
+        if self.prefetch is not None:
+            self.prefetch.close()
+            self.prefetch = None
+
+    def os_initialization(self, answers=None, plan=False):
+        # answers: validated settings from an answers file, skips all prompts
+        # plan:    only list the pending changes (unattended mode)
         print (f"\nInitializing the server for Red Hat based OS - {self.os}")
         print("------------------------------------------------------------")
         """
@@ -65,19 +218,16 @@ class RedhatServer:
         # check CentOS-Base.repo
         if self.os == "CentOS Linux 7":
             print_status("Updating CentOS-Base.repo")
-            file="/etc/yum.repos.d/CentOS-Base.repo"
-            cmds = [f"sudo sed -i 's/^mirrorlist=/#mirrorlist=/' {file}",
-                    f"sudo sed -i 's|^#baseurl=http://mirror.centos.org/|baseurl=http://vault.centos.org/|' {file}",
-                    f"sudo sed -i 's|^baseurl=http://mirror.centos.org/|baseurl=http://vault.centos.org/|' {file}",
-                    ]
-            for cmd in cmds:
-                self.run_interactive_cmd(cmd)
+            self.edit_file("/etc/yum.repos.d/CentOS-Base.repo", [
+                RegexReplace(r"^mirrorlist=", "#mirrorlist="),
+                RegexReplace(r"^#?baseurl=http://mirror.centos.org/", "baseurl=http://vault.centos.org/"),
+            ])
             print("done")
         
         # install epel-release
         self.install_package("epel-release")
         print_status("Updating the server")
-        self.run_interactive_cmd("sudo yum update -y", echo=False, progress=True, timeout=0)
+        self.run_yum("sudo yum update -y")
         print("done")
 
         # and other tools
@@ -92,45 +242,30 @@ class RedhatServer:
             self.install_package("libnsl")   
 
         # install all default packages
-        for package in ["yum-utils","rsync","util-linux","curl","firewalld","bind-utils","telnet","jq","nano",
-                    "ed","tcpdump","wget","nfs-utils","cifs-utils","samba-client","tree","xterm","net-tools",
-                    "openldap-clients","sssd","realmd","oddjob","oddjob-mkhomedir","adcli",
-                    "samba-common","samba-common-tools","krb5-workstation","openldap-clients","iperf3","rsnapshot","zip",
-                    "unzip","ftp","autofs","zsh","ksh","tcsh","ansible","cabextract","fontconfig",
-                    "nedit","htop","tar","traceroute","mtr","pwgen","ipa-admintools"]:
-            self.install_package(package)
+        self.install_packages(DEFAULT_PACKAGES)
 
         """
 
-        print(" o Detecting regional information")
-        stdin, stdout, stderr = self.ssh_client.exec_command("curl -s -m 30 checkip.dyndns.com")
-        output = stdout.read().decode('utf-8')
-        ip_address = output.split(': ')[1].split('<')[0].strip()
-        print_status("Public IP address", ip_address)
+        hostname, timezone = self.detect_settings()
 
-        timezone, city, region, country = get_ip_info(ip_address)
-        # Get current hostname
-        stdin, stdout, stderr = self.ssh_client.exec_command("hostname")
-        hostname = stdout.read().decode('utf-8').strip()
-
-        print_status("Hostname", hostname)        
-        if timezone:
-            print_status("Timezone", timezone)
-            print_status("Location", f"{city}, {region}, {country}")
-        else:
-            print_status("Timezone", "unknown")
-            print_status("Location", "unknown")
+        if answers is not None:
+            hostname = answers.get("hostname") or hostname
+            timezone = answers.get("timezone") or timezone
+            if not timezone:
+                raise RuntimeError("Timezone could not be detected, set it in the answers file")
+            return self.apply_settings(hostname, timezone, answers.get("ssh_keys"), answers.get("disable_selinux", False),
+                                       install_packages=answers.get("install_packages", False),
+                                       dnf_speed=answers.get("dnf_speed", False), plan=plan)
 
         # get users confirmation
+        ssh_key_names = None
         while True:
             print(" o Please confirm the following settings:")
             hostname = input(f"   - Enter the hostname [{hostname}] : ") or hostname
 
             while True:
                 timezone = input(f"   - Enter the timezone [{timezone}] : ") or timezone
-                try:
-                    pytz.timezone(timezone)
-                except pytz.UnknownTimeZoneError:
+                if not is_valid_timezone(timezone):
                     print(f"   - The timezone '{timezone}' is not valid. Please enter a valid timezone.")
                     continue
                 break
@@ -142,6 +277,9 @@ class RedhatServer:
             confirm  = input(f"   - Disable SELinux? (Y/N) [Y] : ") or "Y"
             disable_SELinux  = confirm.lower() == "y"
 
+            confirm  = input(f"   - Install default packages? (Y/N) [N] : ") or "N"
+            install_packages = confirm.lower() == "y"
+
             confirm  = input(f"\n   - Accept above settings? (Y/N) [N] : ") or "N"
             if confirm.lower() == "y":
                 break
@@ -150,53 +288,314 @@ class RedhatServer:
                 if confirm.lower() == "y":
                     return None
 
-        print("\n o Updating the server")     
-
-        # update the hostname
-        print_status(f"Updating hostname to {hostname}")
-        self.run_interactive_cmd(f"sudo hostnamectl set-hostname {hostname}")
-        print("done")
-
-        print_status(f"Set time zone and enable ntp")
-        self.run_interactive_cmd(f"sudo  timedatectl set-timezone {timezone} && sudo  timedatectl set-ntp true")
-        print("done")
+        # drop the background work the answers made irrelevant
+        if self.prefetch is not None:
+            if not ssh_key_names:
+                self.prefetch.cancel("authorized_keys")
+            if not install_packages:
+                self.prefetch.cancel("makecache")
+                self.prefetch.cancel("packages")
+
+        try:
+            self.apply_settings(hostname, timezone, ssh_key_names, disable_SELinux, install_packages)
+        finally:
+            self.stop_prefetch()
+        return True
 
-        print_status(f"Disable dns lookup in SSH")
-        self.run_interactive_cmd(f"sudo sed -i.bak -e 's/^#UseDNS.*/UseDNS no/' -e 's/^UseDNS.*/UseDNS no/' /etc/ssh/sshd_config")
-        print("done")
+    def detect_settings(self):
+        # Detect the current hostname and suggest a timezone from the public IP
+        print(" o Detecting regional information")
+        if not self.facts:
+            self.facts = (self.prefetch and self.prefetch.peek("facts")) or get_facts(self.connection)
+        ip_address = self.facts.get("public_ip")
+        print_status("Public IP address", ip_address or "unknown")
 
-        if ssh_key_names:
-            print_status(f"Add ssh public keys", "")
-            global_config = GlobalConfig()
-            keys = global_config.get("ssh_keys")    
-            self.run_cmd(f"mkdir -p ~/.ssh && chmod 700 ~/.ssh && touch ~/.ssh/authorized_keys && chmod 600 ~/.ssh/authorized_keys")
-
-            # Retrieve existing keys from the remote server
-            existing_keys = self.run_cmd("cat ~/.ssh/authorized_keys").splitlines()
-
-            for key_name in ssh_key_names:
-                key = keys.get(key_name)
-                new_key_entry = f"{key['type']} {key['key']}"
-
-                # Check if the key already exists
-                duplicated_key = False
-                for existing_key in existing_keys:
-                    if key['key'] in existing_key:
-                        print(f"     > Key '{key_name}' already exists on the remote server. Skipping.")
-                        duplicated_key = True
-                        break
-
-                if not duplicated_key:
-                    # Add the new key to the authorized_keys file
-                    self.run_cmd(f"echo '{new_key_entry}' >> ~/.ssh/authorized_keys")
-                    print(f"     > Key '{key_name}' added to the remote server.")
-            
-            print("     > done")
+        location = self.prefetch and self.prefetch.take("geolocation")
+        if location is None:
+            location = get_ip_info(ip_address) if ip_address else (None, None, None, None)
+        timezone, city, region, country = location
+        hostname = self.facts.get("hostname")
 
+        print_status("Hostname", hostname)        
+        if timezone:
+            print_status("Timezone", timezone)
+            print_status("Location", f"{city}, {region}, {country}")
+        else:
+            print_status("Timezone", "unknown")
+            print_status("Location", "unknown")
 
+        return hostname, timezone
+
+    def read_file(self, path):
+        return read_remote_file(self.connection, path, sudo=self.connection.username != "root")
+
+    def edit_file(self, path, edits, backup=True):
+        # Read the file once, apply all edits locally and write it back atomically
+        # only if the content changed. Returns True if the file was changed.
+        content = self.read_file(path)
+        new_content = apply_edits(content, edits)
+        if content_hash(new_content) == content_hash(content):
+            return False
+        if not write_remote_file(self.connection, path, new_content, backup=backup,
+                                 sudo=self.connection.username != "root"):
+            raise IOError(f"Failed to write {path}")
         return True
 
+    def file_step(self, path, edits):
+        # check/apply pair for a step that edits a file
+        def check():
+            content = self.read_file(path)
+            return content_hash(apply_edits(content, edits)) == content_hash(content)
+
+        def apply():
+            try:
+                self.edit_file(path, edits)
+            except IOError:
+                return False
+            return True
+        return check, apply
+
+    def edit_script(self, path, edits):
+        # shell (check, apply) pair for a file step, None if the edits have no shell form
+        try:
+            return file_script(path, edits)
+        except ValueError:
+            return None
+
+    def check_cmd(self, condition):
+        # True when the shell condition holds on the host
+        return self.run_cmd(condition).ok
+
+    def command_step(self, command):
+        # command runs as root
+        def apply():
+            exit_status, output = self.run_root(command)
+            return exit_status == 0
+        return apply
+
+    def settings_steps(self, hostname, timezone, ssh_key_names=None, disable_selinux=False, install_packages=False,
+                       dnf_speed=False):
+        hostname_check = f'[ "$(hostname)" = "{hostname}" ]'
+        hostname_apply = f"hostnamectl set-hostname {hostname}"
+        timezone_check = (f"timedatectl | grep -q 'Time zone: {timezone} ' && "
+                          f"timedatectl | grep -Eq '(NTP enabled|NTP service|Network time on): (yes|active)'")
+        timezone_apply = f"timedatectl set-timezone {timezone} && timedatectl set-ntp true"
+        usedns_edits   = [SetKeyValue("UseDNS", "no", before=r"^Match\s")]
+        steps = [
+            Step("hostname", f"Updating hostname to {hostname}",
+                 lambda: self.check_cmd(hostname_check), self.command_step(hostname_apply),
+                 hostname, script=(hostname_check, hostname_apply)),
+            Step("timezone", f"Set time zone and enable ntp",
+                 lambda: self.check_cmd(timezone_check), self.command_step(timezone_apply),
+                 timezone, script=(timezone_check, timezone_apply)),
+            Step("sshd_usedns", f"Disable dns lookup in SSH",
+                 *self.file_step("/etc/ssh/sshd_config", usedns_edits),
+                 "no", resources=["/etc/ssh/sshd_config"],
+                 script=self.edit_script("/etc/ssh/sshd_config", usedns_edits)),
+        ]
+
+        if disable_selinux:
+            selinux_edits  = [SetKeyValue("SELINUX", "disabled", separator="=")]
+            enforcing      = "[ \"$(getenforce 2>/dev/null)\" != Enforcing ]"
+            check_config, apply_config = self.file_step("/etc/selinux/config", selinux_edits)
+            setenforce = self.command_step("setenforce 0 || true")
+            config_script = self.edit_script("/etc/selinux/config", selinux_edits)
+            steps.append(Step("selinux", f"Disable SELinux",
+                 lambda: self.check_cmd(enforcing) and check_config(),
+                 lambda: setenforce() and apply_config(),
+                 "disabled", resources=["/etc/selinux/config"],
+                 script=config_script and (f"{enforcing} && {config_script[0]}",
+                                           f"{{ setenforce 0 || true; }} && {config_script[1]}")))
+
+        if ssh_key_names:
+            steps.append(self.ssh_keys_step(ssh_key_names))
+
+        speed_step = self.dnf_speed_step() if dnf_speed else None
+        if speed_step is not None:
+            steps.append(speed_step)
+
+        if install_packages:
+            # epel-release provides some of the default packages
+            requires = ["dnf_speed"] if speed_step is not None else []
+            steps.append(self.packages_step("epel", "Enable the EPEL repository", ["epel-release"], requires=requires))
+            steps.append(self.packages_step("packages", "Install default packages", DEFAULT_PACKAGES, requires=["epel"]))
+
+        return steps
+
+    def packages_step(self, name, description, packages, requires=()):
+        step = None
+
+        def check():
+            self.refresh_packages()
+            return all(package in self.installed_packages for package in packages)
+
+        def apply():
+            step.details.clear()
+            if self.prefetch is not None:
+                # let the metadata refresh finish instead of racing it for the yum lock
+                self.prefetch.take("makecache")
+            self.last_download = {}
+            failed = list(self.install_packages(packages, verbose=False, progress=step.progress))
+            for package in failed:
+                step.details.append(f"Package '{package}' could not be installed.")
+            if self.last_download.get("rate"):
+                # informational, the rate doesn't decide the outcome
+                step.details.append(self.record_download(self.last_download))
+            if failed:
+                step.details.append(f"See {get_host_log(self.connection.hostname, self.connection.port).path}")
+            return not failed
+
+        # the script checks each package again after the transaction, like refresh_packages()
+        names = " ".join(shlex.quote(package) for package in packages)
+        yum   = "yum --setopt=keepcache=1" if self.rpm_cache is not None else "yum"
+        script = (f"rpm -q --quiet {names}",
+                  f"{yum} install -y {names}; ls_rc=0; for ls_package in {names}; do "
+                  f"rpm -q --quiet \"$ls_package\" || {{ ls_detail \"Package '$ls_package' could not be installed.\"; ls_rc=1; }}; "
+                  f"done; return $ls_rc")
+
+        step = Step(name, description, check, apply, ",".join(packages), requires=requires, resources=["rpm"],
+                    script=script)
+        return step
+
+    def dnf_speed_step(self):
+        # Faster dnf downloads, None on yum-only releases (EL7)
+        match = re.search(r"(\d+)", self.os)
+        major = int(match.group(1)) if match else 0
+        if major < 8:
+            return None
+        edits = [SetKeyValue(key, value, separator="=") for key, value in DNF_SPEED_SETTINGS]
+        if major == 8:
+            # delta RPMs are gone from EL9 repositories
+            edits.append(SetKeyValue("deltarpm", "True", separator="="))
+        step = Step("dnf_speed", "Speed up dnf downloads", *self.file_step("/etc/dnf/dnf.conf", edits),
+                    ",".join(f"{edit.key}={edit.value}" for edit in edits), resources=["rpm", "/etc/dnf/dnf.conf"],
+                    script=self.edit_script("/etc/dnf/dnf.conf", edits))
+        return step
+
+    def ssh_keys_step(self, ssh_key_names):
+        keys = GlobalConfig().get("ssh_keys") or {}
+        entries = {key_name: f"{keys[key_name]['type']} {keys[key_name]['key']} {key_name}" for key_name in ssh_key_names}
+        state = {}
+
+        def merge():
+            # Retrieve existing keys from the remote server once; None if they
+            # could not be read, the file must not be rewritten from that
+            if "content" not in state:
+                result = (self.prefetch and self.prefetch.take("authorized_keys")) or self.run_cmd(READ_AUTHORIZED_KEYS)
+                if result.ok and not result.stdout_truncated:
+                    state["content"] = result.text
+                else:
+                    state["content"] = None
+                    state["error"] = ("timed out" if result.timed_out else "output truncated" if result.ok else
+                                      result.error_text.strip() or f"exit code {result.exit_code}")
+            if state["content"] is None:
+                return None
+            return merge_authorized_keys(state["content"], entries)
+
+        def check():
+            merged = merge()
+            return merged is not None and merged[0] is None
+
+        def apply():
+            step.details.clear()
+            merged = merge()
+            state.pop("content", None)
+            if merged is None:
+                step.details.append(f"Failed to read ~/.ssh/authorized_keys: {state.pop('error')}")
+                return False
+            content, added, present = merged
+            for key_name in present:
+                step.details.append(f"Key '{key_name}' already exists on the remote server. Skipping.")
+            if content is None:
+                return True
+
+            # write the merged file once, atomically and with the right permissions
+            result = self.run_cmd(
+                "umask 077 && mkdir -p ~/.ssh && chmod 700 ~/.ssh && "
+                "cat > ~/.ssh/.authorized_keys.tmp && mv -f ~/.ssh/.authorized_keys.tmp ~/.ssh/authorized_keys && "
+                "chmod 600 ~/.ssh/authorized_keys", input=content)
+            if not result.ok:
+                step.details.append(result.error_text.strip() or f"exit code {result.exit_code}")
+                return False
+            for key_name in added:
+                step.details.append(f"Key '{key_name}' added to the remote server.")
+            return True
+
+        # shell form: a key is present when its base64 blob is, which is what the
+        # fingerprint comparison of merge_authorized_keys amounts to
+        key_file = '"$LS_HOME/.ssh/authorized_keys"'
+        blobs    = {key_name: shlex.quote(keys[key_name]['key']) for key_name in ssh_key_names}
+        check_script = " && ".join(f"grep -qF -- {blob} {key_file}" for blob in blobs.values())
+        apply_script = " && ".join(
+            ['umask 077', 'mkdir -p "$LS_HOME/.ssh"', f"touch {key_file}",
+             f'{{ [ -z "$(tail -c 1 {key_file})" ] || echo >> {key_file}; }}'] +
+            [f"if grep -qF -- {blobs[key_name]} {key_file}; then "
+             f"ls_detail {shlex.quote(f'Key {key_name!r} already exists on the remote server. Skipping.')}; "
+             f"else echo {shlex.quote(entries[key_name])} >> {key_file} && "
+             f"ls_detail {shlex.quote(f'Key {key_name!r} added to the remote server.')}; fi"
+             for key_name in ssh_key_names] +
+            ['chown "$LS_USER": "$LS_HOME/.ssh" ' + key_file, 'chmod 700 "$LS_HOME/.ssh"', f"chmod 600 {key_file}"])
+
+        step = Step("ssh_keys", f"Add ssh public keys", check, apply, ",".join(sorted(ssh_key_names)),
+                    resources=["~/.ssh/authorized_keys"], script=(check_script, apply_script))
+        return step
+
+    def apply_settings(self, hostname, timezone, ssh_key_names=None, disable_selinux=False, install_packages=False,
+                       dnf_speed=False, plan=False):
+        # Bring the host to the confirmed settings, only changing what differs.
+        # Returns the failed steps, or the pending changes in plan mode.
+        steps   = self.settings_steps(hostname, timezone, ssh_key_names, disable_selinux, install_packages, dnf_speed)
+        journal = Journal(self.connection.hostname, self.connection.port)
+
+        script   = self.script_mode and all(step.script is not None for step in steps)
+        history  = get_history()
+        started  = time.time()
+        run_id   = history and history.begin_run(self.connection.hostname, self.connection.port,
+                                                  "plan" if plan else "script" if script else "steps")
+        failures = None
+        self.history_run = run_id
+        try:
+            if plan:
+                pending  = plan_steps(steps, journal, host=self.connection.hostname, port=self.connection.port)
+                failures = [step.description for step in pending]
+                return failures
+
+            print("\n o Updating the server")     
+            if script:
+                failures = self.apply_script(steps, journal)
+            else:
+                workers  = GlobalConfig().get("steps workers", DEFAULT_STEP_WORKERS)
+                failures = apply_steps(steps, journal, host=self.connection.hostname, port=self.connection.port,
+                                       workers=workers)
+        finally:
+            self.history_run = None
+            if run_id:
+                status = "error" if failures is None else "pending" if plan and failures else "failed" if failures else "ok"
+                history.end_run(run_id, status, failures or [], started, initialized=status == "ok" and not plan)
+
+        # the host has changed, collect the facts again next time
+        invalidate_facts(self.connection.hostname, self.connection.port)
+        self.facts = {}
+        return failures
+
+    def apply_script(self, steps, journal):
+        # All steps in one round trip, see plan_script.py
+        installs = any("rpm" in step.resources for step in steps)
+        if installs and self.prefetch is not None:
+            # let the metadata refresh finish instead of racing it for the yum lock
+            self.prefetch.take("makecache")
+        attached = installs and self.rpm_cache is not None and self.rpm_cache.attach(self)
+        try:
+            failures = run_script_steps(self.connection, steps, journal, host=self.connection.hostname,
+                                        port=self.connection.port)
+        finally:
+            if attached:
+                self.rpm_cache.detach(self)
+        if installs and self.rpm_cache is not None:
+            self.rpm_cache.collect(self)
+        self.installed_packages = None
+        return failures
 
     def close(self):
-        self.ssh_client.close()
+        self.connection.close()
  
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Structured edits for remote text files: the file is read once, every edit
+# is applied locally and the result is written back only if it changed
+
+import  re
+import  shlex
+import  hashlib
+
+from    tracing                         import span
+
+class SetKeyValue:
+    # Set "key<separator>value". The first active line for the key is replaced
+    # and later active duplicates are dropped. Without an active line, a
+    # commented-out directive ("#UseDNS yes", no space after the #) is replaced;
+    # prose comments that merely start with the key are left alone. If the key
+    # is missing the line is appended, or inserted before the first line matching
+    # "before" (e.g. the first Match block of sshd_config).
+    def __init__(self, key, value, separator=" ", before=None):
+        self.key       = key
+        self.value     = value
+        self.separator = separator
+        if separator.strip():
+            tail = rf"{re.escape(key)}\s*{re.escape(separator.strip())}"
+        else:
+            tail = rf"{re.escape(key)}(\s|$)"
+        self.pattern   = re.compile(rf"^\s*{tail}")
+        self.commented = re.compile(rf"^\s*#{tail}")
+        self.before    = re.compile(before) if before else None
+
+    def apply(self, lines):
+        wanted = f"{self.key}{self.separator}{self.value}"
+        active = [i for i, line in enumerate(lines) if self.pattern.match(line)]
+        if active:
+            result = list(lines)
+            result[active[0]] = wanted
+            return [line for i, line in enumerate(result) if i not in active[1:]]
+
+        for i, line in enumerate(lines):
+            if self.commented.match(line):
+                return lines[:i] + [wanted] + lines[i + 1:]
+
+        result = list(lines)
+        index  = len(result)
+        if self.before is not None:
+            for i, line in enumerate(result):
+                if self.before.match(line):
+                    index = i
+                    break
+        result.insert(index, wanted)
+        return result
+
+class RegexReplace:
+    # re.sub on every line
+    def __init__(self, pattern, replacement, flags=0):
+        self.pattern     = re.compile(pattern, flags)
+        self.replacement = replacement
+
+    def apply(self, lines):
+        return [self.pattern.sub(self.replacement, line) for line in lines]
+
+class EnsureLine:
+    # Append the line unless it is already present
+    def __init__(self, line):
+        self.line = line
+
+    def apply(self, lines):
+        if self.line in lines:
+            return lines
+        return lines + [self.line]
+
+def apply_edits(content, edits):
+    lines = content.splitlines()
+    for edit in edits:
+        lines = edit.apply(lines)
+    return "\n".join(lines) + "\n" if lines else ""
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def read_remote_file(connection, path, sudo=False):
+    # Read over SFTP, falling back to "sudo cat" for files the login user cannot read
+    sftp = connection.open_sftp()
+    try:
+        with span(f"read {path}", "sftp", host=connection.hostname) as trace, sftp.open(path, 'r') as f:
+            data = f.read()
+            trace.received(len(data))
+            return data.decode('utf-8')
+    except PermissionError:
+        if not sudo:
+            raise
+    finally:
+        connection.close_sftp(sftp)
+    result = connection.exec(f"sudo cat {shlex.quote(path)}")
+    if not result.ok and connection.root_shell is not None and connection.root_shell.is_open():
+        # sudo still wants a password (--plan doesn't enable passwordless sudo),
+        # the root shell opened by get_server can read it
+        exit_status, output = connection.root_shell.run(f"cat {shlex.quote(path)}")
+        if exit_status == 0:
+            return output
+    if not result.ok:
+        raise IOError(f"Failed to read {path}: {result.error_text.strip()}")
+    return result.text
+
+def write_remote_file(connection, path, content, backup=True, sudo=False):
+    # Upload next to the target (or to the login user's home when sudo is needed)
+    # and rename it into place, keeping the mode and owner of the original and a .bak copy
+    quoted = shlex.quote(path)
+    sftp = connection.open_sftp()
+    try:
+        if sudo:
+            temp_path = sftp.normalize(".") + f"/.linuxsetup.{content_hash(path)[:12]}.tmp"
+        else:
+            temp_path = f"{path}.linuxsetup.tmp"
+        data = content.encode('utf-8')
+        with span(f"write {path}", "sftp", host=connection.hostname) as trace, sftp.open(temp_path, 'w') as f:
+            f.write(data)
+            trace.sent(len(data))
+    finally:
+        connection.close_sftp(sftp)
+
+    temp = shlex.quote(temp_path)
+    commands = ["umask 077"]
+    if backup:
+        commands.append(f"cp -p {quoted} {quoted}.bak")
+    commands += [
+        f"cat {temp} > {quoted}.new",
+        f"chmod --reference={quoted} {quoted}.new",
+        f"chown --reference={quoted} {quoted}.new",
+        f"mv -f {quoted}.new {quoted}",
+        f"rm -f {temp}",
+    ]
+    script = " && ".join(commands)
+    if sudo:
+        script = f"sudo sh -c {shlex.quote(script)}"
+    return connection.exec(script).ok
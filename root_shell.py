@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Persistent root shell on one interactive channel. "sudo -i" is entered once,
+# then commands run back to back; each command's output and exit status are
+# framed by unique sentinels, so no channel setup or sudo is paid per command.
+
+import  re
+import  time
+import  uuid
+import  threading
+
+from    expect                          import Expect, ExpectTimeout, ExpectEOF
+from    tracing                         import span
+from    host_log                        import get_host_log
+
+# prompts only match at the very end of the received output, where the shell
+# waits for input; a banner line ending in "#" or ":" is followed by a newline
+PASSWORD_PROMPT = re.compile(r"[Pp]assword( for [^\n:]*)?:[ \t]*\Z")
+SUDO_FAILED     = re.compile(r"Sorry, try again|incorrect password|is not in the sudoers|not allowed to execute")
+ROOT_PROMPT     = re.compile(r"#[ \t]?\Z")
+
+class RootShellError(RuntimeError):
+    pass
+
+class RootShell:
+    def __init__(self, connection, password=None, timeout=30):
+        self.connection = connection
+        self.password   = password
+        self.timeout    = timeout
+        self.channel    = None
+        self.session    = None
+        self.lock       = threading.Lock()
+        self.token      = uuid.uuid4().hex[:12]
+        self.counter    = 0
+        self.password_required = False
+
+    def is_open(self):
+        return self.channel is not None and not self.channel.closed
+
+    def open(self):
+        with span("root shell", "exec", host=self.connection.hostname) as trace:
+            self.channel = self.connection.invoke_shell()
+            self.session = Expect(self.channel, trace=trace)
+            try:
+                if self.connection.username != "root":
+                    self._sudo()
+                # quiet, prompt-less shell; the sentinel confirms we are root
+                self.session.sendline("stty -echo 2>/dev/null; PS1=''; PS2=''; unset PROMPT_COMMAND; export LC_ALL=C")
+                ready = f"__LS_READY_{self.token}"
+                self.session.sendline(f"echo '__LS_READY_'\"{self.token}\"_$(id -u)")
+                self.session.expect([re.escape(ready) + r"_(\d+)"], timeout=self.timeout)
+                if self.session.match.group(1) != "0":
+                    raise RootShellError(f"{self.connection.hostname}: shell is not running as root")
+            except (ExpectTimeout, ExpectEOF) as e:
+                self.close()
+                raise RootShellError(f"{self.connection.hostname}: failed to open a root shell: {e}") from e
+            except BaseException:
+                self.close()
+                raise
+        return self
+
+    def _sudo(self):
+        # Enter "sudo -i", answering the password prompt once. The login
+        # banner and prompt are arbitrary, so only anchored patterns are used.
+        self.session.sendline("sudo -i")
+        index = self.session.expect([PASSWORD_PROMPT, ROOT_PROMPT], timeout=self.timeout)
+        if index == 0:
+            if not self.password:
+                raise RootShellError(f"{self.connection.hostname}: sudo requires a password")
+            self.password_required = True
+            self.session.sendline(self.password)
+            index = self.session.expect([SUDO_FAILED, PASSWORD_PROMPT, ROOT_PROMPT], timeout=self.timeout)
+            if index != 2:
+                raise RootShellError(f"{self.connection.hostname}: sudo rejected the password")
+
+    def run(self, command, timeout=None):
+        # Run a single-line command as root, returns (exit_status, output).
+        # stdin is /dev/null so the command cannot swallow the next one.
+        with self.lock:
+            if not self.is_open():
+                self.open()
+            self.counter += 1
+            marker = f"{self.token}_{self.counter}"
+            output = []
+            session = self.session
+            log = get_host_log(self.connection.hostname, self.connection.port)
+            with span(command, "exec", host=self.connection.hostname, shell="root") as trace:
+                log_id = log.begin(f"(root shell) {command}")
+                session.trace    = trace
+                session.overflow = output.append
+                try:
+                    # quoting splits the markers, so an echoed command line never matches
+                    session.sendline(f"echo '__LS_B'\"{marker}\"; {{ {command} ; }} < /dev/null; "
+                                     f"echo \"__LS_E\"'{marker}'_$?")
+                    session.expect([re.escape(f"__LS_B{marker}") + r"\r?\n"], timeout or self.timeout)
+                    output.clear()
+                    session.expect([re.escape(f"__LS_E{marker}") + r"_(\d+)\r?\n"], timeout or self.timeout)
+                except (ExpectTimeout, ExpectEOF):
+                    # the shell state is unknown, start a fresh one next time
+                    self.close()
+                    log.end(log_id, None, time.perf_counter() - trace.start_perf)
+                    raise
+                finally:
+                    session.overflow = None
+                    session.trace    = None
+                output.append(session.before)
+                output = "".join(output).replace("\r\n", "\n")
+                trace.exit_code = int(session.match.group(1))
+                log.write(log_id, output)
+                log.end(log_id, trace.exit_code, time.perf_counter() - trace.start_perf)
+        return trace.exit_code, output
+
+    def close(self):
+        if self.channel is not None:
+            self.connection.release_channel(self.channel)
+            self.channel = None
+            self.session = None
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Controller-side RPM cache. RPMs downloaded by the first host are pulled back
+# over SFTP into a local yum repository, which is served to every following
+# host through a reverse port-forward on its SSH transport, so only the first
+# host of a rollout downloads from the public mirrors.
+
+import  os
+import  re
+import  shutil
+import  socket
+import  select
+import  threading
+import  functools
+import  subprocess
+import  http.server
+
+from    global_config                   import GlobalConfig, DEFAULT_CONFIG_ROOT
+
+DEFAULT_CACHE_PATH = os.path.join(DEFAULT_CONFIG_ROOT, "rpm_cache")
+REPO_FILE          = "/etc/yum.repos.d/linuxsetup-cache.repo"
+REMOTE_CACHE_DIRS  = "/var/cache/dnf /var/cache/yum"
+REMOTE_GPG_KEYS    = "/etc/pki/rpm-gpg/RPM-GPG-KEY-*"
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+class RpmCache:
+    def __init__(self, path=None):
+        self.path       = os.path.expanduser(path or GlobalConfig().get("rpm_cache path", DEFAULT_CACHE_PATH))
+        self.lock       = threading.Lock()
+        self.httpd      = None
+        self.http_port  = None
+        self.createrepo = shutil.which("createrepo_c") or shutil.which("createrepo")
+
+    def available(self):
+        # Serving the cache needs repository metadata built on the controller
+        return self.createrepo is not None
+
+    def repo_dir(self, server):
+        # One repository per OS release and architecture
+        arch = server.run_cmd("uname -m").text.strip() or "noarch"
+        slug = re.sub(r"[^A-Za-z0-9]+", "-", f"{server.os}-{arch}").strip("-").lower()
+        return os.path.join(self.path, slug)
+
+    def _serve(self):
+        with self.lock:
+            if self.httpd is None:
+                handler = functools.partial(QuietHandler, directory=self.path)
+                self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+                self.http_port = self.httpd.server_address[1]
+                threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self.http_port
+
+    def _forward(self, channel, origin, server):
+        threading.Thread(target=self._pipe, args=(channel,), daemon=True).start()
+
+    def _pipe(self, channel):
+        # Copy bytes between a forwarded SSH channel and the local HTTP server
+        try:
+            sock = socket.create_connection(("127.0.0.1", self.http_port))
+        except OSError:
+            channel.close()
+            return
+        try:
+            while True:
+                readable, _, _ = select.select([sock, channel], [], [])
+                if sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        break
+                    channel.sendall(data)
+                if channel in readable:
+                    data = channel.recv(65536)
+                    if not data:
+                        break
+                    sock.sendall(data)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+            channel.close()
+
+    def attach(self, server):
+        # Serve the cached repository to the host, returns False if there is nothing to serve
+        repo_dir = self.repo_dir(server)
+        if not os.path.isdir(os.path.join(repo_dir, "repodata")):
+            return False
+
+        self._serve()
+        transport = server.connection.get_transport()
+        remote_port = transport.request_port_forward("127.0.0.1", 0, handler=self._forward)
+        server.cache_forward = remote_port
+
+        # The cached files are the signed upstream RPMs, every target checks them
+        # against its own vendor/EPEL keys. Only the generated metadata is
+        # unsigned. The low cost makes yum prefer this repository over the mirrors.
+        # On a fresh host those keys are not imported yet, gpgkey lets yum import
+        # them from the host's own key files like it does for the vendor repos.
+        keys   = server.run_cmd(f"ls -1 {REMOTE_GPG_KEYS} 2>/dev/null").text.split()
+        gpgkey = f"gpgkey={' '.join('file://' + key for key in keys)}\n" if keys else ""
+        repo   = (f"[linuxsetup-cache]\n"
+                  f"name=linuxsetup controller cache\n"
+                  f"baseurl=http://127.0.0.1:{remote_port}/{os.path.basename(repo_dir)}/\n"
+                  f"enabled=1\n"
+                  f"gpgcheck=1\n"
+                  f"{gpgkey}"
+                  f"repo_gpgcheck=0\n"
+                  f"cost=10\n"
+                  f"skip_if_unavailable=1\n"
+                  f"metadata_expire=0\n")
+        if not server.run_cmd(f"sudo tee {REPO_FILE} > /dev/null", input=repo).ok:
+            self.detach(server)
+            return False
+        return True
+
+    def detach(self, server):
+        server.run_cmd(f"sudo rm -f {REPO_FILE}")
+        remote_port = getattr(server, "cache_forward", None)
+        if remote_port:
+            server.connection.get_transport().cancel_port_forward("127.0.0.1", remote_port)
+            server.cache_forward = None
+
+    def collect(self, server):
+        # Pull RPMs from the host's yum/dnf cache that the controller does not have yet
+        repo_dir = self.repo_dir(server)
+        os.makedirs(repo_dir, exist_ok=True)
+        remote_files = server.run_cmd(f"sudo find {REMOTE_CACHE_DIRS} -name '*.rpm' 2>/dev/null").text.split()
+        missing = [path for path in remote_files
+                   if not os.path.exists(os.path.join(repo_dir, os.path.basename(path)))]
+        if not missing:
+            return 0
+
+        sftp = server.connection.open_sftp()
+        try:
+            for remote_path in missing:
+                local_path = os.path.join(repo_dir, os.path.basename(remote_path))
+                # one temporary name per transfer, hosts may collect the same RPM at once
+                temp_path  = f"{local_path}.{os.getpid()}.{threading.get_ident()}.part"
+                try:
+                    sftp.get(remote_path, temp_path)
+                except OSError:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    continue
+                os.replace(temp_path, local_path)
+        finally:
+            server.connection.close_sftp(sftp)
+
+        with self.lock:
+            subprocess.run([self.createrepo, "--update", "--quiet", repo_dir], check=False)
+        return len(missing)
+
+    def close(self):
+        with self.lock:
+            if self.httpd is not None:
+                self.httpd.shutdown()
+                self.httpd.server_close()
+                self.httpd = None
@@ -6,66 +6,154 @@ import os
 import sys
 import re
 import time
+import codecs
+import select
 import logging
-import paramiko
+
+from tracing import span
+from host_log import get_host_log, RingBuffer
+
+RECV_SIZE = 32768
+
+def print_status(msg, status=None):
+    if status == None:
+        print(f"   - {msg:<40} : ", end="")
+    else:
+        print(f"   - {msg:<40} : {status}")
 
 def spinner_generator():
     while True:
         for cursor in '|/-\\':
             yield cursor
-            
-def server_run_cmd(ssh_client, command, echo=False, progress=False, timeout=30):
+
+def open_command_channel(connection, command):
     # Open a session with a pseudo-terminal
-    transport = ssh_client.get_transport()
-    channel = transport.open_session()
+    channel = connection.open_channel()
     channel.get_pty()
     channel.exec_command(command)
+    return channel
+
+def stream_channel(channel, command="", timeout=30, reset_timer=True, trace=None):
+    # Yield decoded output chunks from stdout and stderr as soon as they arrive.
+    # The channel's fileno() is signalled by paramiko whenever either buffer
+    # receives data or the channel is closed, so no polling is needed.
+    # timeout is measured from the last received data when reset_timer is set,
+    # otherwise from the start of the command; 0 disables it.
+    # trace: optional tracing span that counts the received bytes
+    # one decoder per stream, a character split across chunks of one stream
+    # must not be joined with bytes of the other
+    streams = [(channel.recv_ready, channel.recv, codecs.getincrementaldecoder('utf-8')(errors='replace')),
+               (channel.recv_stderr_ready, channel.recv_stderr, codecs.getincrementaldecoder('utf-8')(errors='replace'))]
+    start_time = time.monotonic()
+
+    while True:
+        received = False
+        for ready, recv, decoder in streams:
+            while ready():
+                data = recv(RECV_SIZE)
+                if not data:
+                    break
+                received = True
+                if trace is not None:
+                    trace.received(len(data))
+                text = decoder.decode(data)
+                if text:
+                    yield text
+
+        if received:
+            if reset_timer:
+                start_time = time.monotonic()
+            continue
 
-    spinner = spinner_generator()
-    start_time = time.time()
-    last_progress_time = start_time
-    if progress:
-        print(" ", end='', flush=True)
-
-    output = ""
-    try:
-        while True:
-            if echo:
-                if channel.recv_ready():
-                    data = channel.recv(1024).decode('utf-8')
-                    output += data
-                    print(data, end='')
-                    # restart timer
-                    start_time = time.time()
-            elif progress:
-                if time.time() - last_progress_time > 0.2:
-                    if channel.recv_ready():
-                        #if not cursor_hidden:
-                        #    print("\033[?25l", end='', flush=True)  # Hide cursor
-                        #    cursor_hidden = True
-                        #while stdout.channel.recv_ready():
-                        data = channel.recv(1024).decode('utf-8') 
-                        #print(next(spinner) + "\b", end='', flush=True)
-                        print("\b" + next(spinner), end='', flush=True)
-                        start_time = time.time()
-                    last_progress_time = time.time()
-            
-            if channel.exit_status_ready():
-                break
-
-            time.sleep(0.1)  # Wait for 0.1 seconds
-
-            if timeout > 0 and time.time() - start_time > timeout:
+        if channel.eof_received or channel.closed:
+            break
+
+        wait = None
+        if timeout > 0:
+            wait = timeout - (time.monotonic() - start_time)
+            if wait <= 0:
                 raise TimeoutError(f"Command {command} timed out after {timeout} seconds")
-                
-    finally:
+        select.select([channel], [], [], wait)
+
+    for ready, recv, decoder in streams:
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+def split_lines(chunks):
+    # Re-assemble arbitrary text chunks into complete lines (line endings kept)
+    pending = []
+    for chunk in chunks:
+        lines = chunk.splitlines(keepends=True)
+        if pending and lines:
+            lines[0] = "".join(pending) + lines[0]
+            pending = []
+        if lines and not lines[-1].endswith(("\n", "\r")):
+            pending.append(lines.pop())
+        yield from lines
+    if pending:
+        yield "".join(pending)
+
+def server_stream_cmd(connection, command, timeout=30):
+    # Run a command and yield its output line by line.
+    # The exit status is the generator's return value (see "yield from").
+    log = get_host_log(connection.hostname, connection.port)
+    with span(command, "exec", host=connection.hostname) as trace:
+        log_id = log.begin(command)
+        channel = open_command_channel(connection, command)
+        try:
+            for line in split_lines(stream_channel(channel, command, timeout=timeout, trace=trace)):
+                log.write(log_id, line)
+                yield line
+            trace.exit_code = channel.recv_exit_status()
+            return trace.exit_code
+        finally:
+            log.end(log_id, trace.exit_code, time.perf_counter() - trace.start_perf)
+            connection.release_channel(channel)
+
+def server_run_cmd(connection, command, echo=False, progress=False, timeout=30, callback=None):
+    # Returns (exit_status, tail): the full output goes to the host log,
+    # only the most recent output is kept in memory for error reporting
+    log = get_host_log(connection.hostname, connection.port)
+    with span(command, "exec", host=connection.hostname) as trace:
+        log_id = log.begin(command)
+        channel = open_command_channel(connection, command)
+
+        spinner = spinner_generator()
+        last_progress_time = time.monotonic()
         if progress:
-            print("\b", end='', flush=True)
-        #if cursor_hidden:
-        #    print("\033[?25h", end='', flush=True)  # Show cursor
+            print(" ", end='', flush=True)
+
+        tail = RingBuffer()
+        exit_status = None
+
+        def record(chunks):
+            # log the raw chunks, before any splitting into lines
+            for data in chunks:
+                log.write(log_id, data)
+                tail.append(data)
+                yield data
 
-    exit_status = channel.recv_exit_status()
-    return exit_status, output
+        try:
+            chunks = record(stream_channel(channel, command, timeout=timeout, reset_timer=echo or progress, trace=trace))
+            if callback is not None:
+                chunks = split_lines(chunks)
 
+            for data in chunks:
+                if callback is not None:
+                    callback(data)
+                if echo:
+                    print(data, end='', flush=True)
+                elif progress and time.monotonic() - last_progress_time > 0.2:
+                    print("\b" + next(spinner), end='', flush=True)
+                    last_progress_time = time.monotonic()
 
+            exit_status = channel.recv_exit_status()
+            trace.exit_code = exit_status
+        finally:
+            log.end(log_id, exit_status, time.perf_counter() - trace.start_perf)
+            if progress:
+                print("\b", end='', flush=True)
+            connection.release_channel(channel)
 
+    return exit_status, tail.text()
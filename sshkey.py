@@ -5,9 +5,88 @@
 # SSH public key manager
 
 import  json
-import  simple_term_menu
+import  base64
+import  shlex
+import  hashlib
 from    global_config                    import GlobalConfig
 
+KEY_TYPE_PREFIXES = ("ssh-", "ecdsa-", "sk-ssh-", "sk-ecdsa-")
+
+def key_fingerprint(key_value):
+    # OpenSSH style SHA256 fingerprint of the base64 key blob
+    digest = hashlib.sha256(base64.b64decode(key_value)).digest()
+    return "SHA256:" + base64.b64encode(digest).decode('ascii').rstrip('=')
+
+def parse_public_key(line):
+    # Parse an authorized_keys / .pub line into options, type, key, comment and
+    # fingerprint, returns None for blank, comment or malformed lines
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    # options may contain quoted spaces, so split off the key type carefully
+    try:
+        tokens = shlex.split(line, posix=False)
+    except ValueError:
+        return None
+    for index, token in enumerate(tokens):
+        if token.startswith(KEY_TYPE_PREFIXES) and index + 1 < len(tokens):
+            try:
+                fingerprint = key_fingerprint(tokens[index + 1])
+            except ValueError:
+                return None
+            return {
+                "options":     " ".join(tokens[:index]),
+                "type":        token,
+                "key":         tokens[index + 1],
+                "comment":     " ".join(tokens[index + 2:]),
+                "fingerprint": fingerprint,
+            }
+    return None
+
+def ssh_key_index(keys=None):
+    # Map the fingerprint of every stored key to its name
+    if keys is None:
+        keys = GlobalConfig().get("ssh_keys") or {}
+    index = {}
+    for key_name, key_data in keys.items():
+        fingerprint = key_data.get("fingerprint")
+        if not fingerprint:
+            try:
+                fingerprint = key_fingerprint(key_data["key"])
+            except (KeyError, ValueError):
+                continue
+        index[fingerprint] = key_name
+    return index
+
+def merge_authorized_keys(content, entries):
+    # Merge {name: key line} into the authorized_keys content as a set
+    # operation on fingerprints. Returns (new content or None if unchanged,
+    # added names, already existing names).
+    existing = set()
+    for line in content.splitlines():
+        parsed = parse_public_key(line)
+        if parsed:
+            existing.add(parsed["fingerprint"])
+
+    added, present, new_lines = [], [], []
+    for key_name, entry in entries.items():
+        parsed = parse_public_key(entry)
+        if parsed is None:
+            continue
+        if parsed["fingerprint"] in existing:
+            present.append(key_name)
+        else:
+            existing.add(parsed["fingerprint"])
+            added.append(key_name)
+            new_lines.append(entry.strip())
+
+    if not new_lines:
+        return None, added, present
+    if content and not content.endswith("\n"):
+        content += "\n"
+    return content + "\n".join(new_lines) + "\n", added, present
+
 def add_new_ssh_key():
     print ("\n o Adding a new key")
 
@@ -18,23 +97,22 @@ def add_new_ssh_key():
     while True:
         new_ssh_key = input("   - Enter the ssh public key : ")
 
-        key_parts = new_ssh_key.split()
-        if len(key_parts) < 2:
+        parsed = parse_public_key(new_ssh_key)
+        if parsed is None:
             print("Invalid key format. Please enter a valid ssh public key.")
             continue
 
         break
 
-    new_key_type  = key_parts[0]
-    new_key_value = key_parts[1]
-    new_key_name  = key_parts[2] if len(key_parts) > 2 else ""
+    new_key_type  = parsed["type"]
+    new_key_value = parsed["key"]
+    new_key_name  = parsed["comment"].split()[0] if parsed["comment"] else ""
 
     # now search if the key already exists
-    if keys is not None:
-        for key_name, key_data in keys.items():
-            if new_key_value == key_data["key"]:
-                print(f"     > Duplicate key detected. Key name: {key_name}")
-                return key_name
+    key_name = ssh_key_index(keys or {}).get(parsed["fingerprint"])
+    if key_name is not None:
+        print(f"     > Duplicate key detected. Key name: {key_name}")
+        return key_name
 
     # get key name
     while True:
@@ -51,12 +129,16 @@ def add_new_ssh_key():
         break
 
     # Optionally, you can add the new key to the global configuration
-    global_config.set(f"ssh_keys {new_key_name} type", new_key_type)
-    global_config.set(f"ssh_keys {new_key_name} key", new_key_value)
+    with global_config.batch():
+        global_config.set(f"ssh_keys {new_key_name} type", new_key_type)
+        global_config.set(f"ssh_keys {new_key_name} key", new_key_value)
+        global_config.set(f"ssh_keys {new_key_name} fingerprint", parsed["fingerprint"])
     print("   - New key added successfully")
     return new_key_name
 
 def retrieve_ssh_key():
+    import simple_term_menu
+
     menu_entries = []
     # try to retrieve the list of ssh keys from the global configuration
     global_config = GlobalConfig()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Import time profiler for --startup-profile
+
+import  sys
+import  time
+import  builtins
+import  importlib
+
+class ImportProfiler:
+    # Times every first import made through __import__ or importlib.import_module,
+    # keeping both the cumulative time and the time spent in the module itself
+    def __init__(self):
+        self.records = []
+        self.stack   = []
+        self.original_import        = None
+        self.original_import_module = None
+
+    def install(self):
+        self.original_import        = builtins.__import__
+        self.original_import_module = importlib.import_module
+        builtins.__import__     = self._import
+        importlib.import_module = self._import_module
+
+    def uninstall(self):
+        builtins.__import__     = self.original_import
+        importlib.import_module = self.original_import_module
+
+    def _timed(self, name, load):
+        if name in sys.modules:
+            return load()
+        self.stack.append(0.0)
+        start_time = time.perf_counter()
+        try:
+            return load()
+        finally:
+            elapsed  = time.perf_counter() - start_time
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            self.records.append((name, elapsed, elapsed - children))
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        load = lambda: self.original_import(name, globals, locals, fromlist, level)
+        if level:
+            return load()
+        return self._timed(name, load)
+
+    def _import_module(self, name, package=None):
+        return self._timed(name, lambda: self.original_import_module(name, package))
+
+    def report(self, limit=30):
+        self.uninstall()
+        total = sum(self_time for name, elapsed, self_time in self.records)
+        print(f"\n o Startup profile: {len(self.records)} modules imported in {total * 1000:.1f} ms")
+        print(f"   {'Module':<40} {'Self ms':>9} {'Cumulative ms':>14}")
+        print(f"   {'-' * 40} {'-' * 9} {'-' * 14}")
+        for name, elapsed, self_time in sorted(self.records, key=lambda record: record[1], reverse=True)[:limit]:
+            print(f"   {name:<40} {self_time * 1000:>9.1f} {elapsed * 1000:>14.1f}")
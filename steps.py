@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Declarative setup steps with drift detection and a resumable per-host journal
+
+import  os
+import  sys
+import  json
+import  time
+
+from    concurrent.futures              import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from    global_config                   import GlobalConfig, DEFAULT_LOG_PATH
+from    server                          import print_status
+from    tracing                         import span
+
+DEFAULT_STEP_WORKERS = 4
+PROGRESS_INTERVAL    = 0.2
+
+class Step:
+    # name:      stable identifier used in the journal
+    # signature: the desired state, a journaled step is only skipped if it matches
+    # check():   True when the host is already in the desired state
+    # apply():   make the change, True on success
+    # details:   lines apply() wants printed below the step status
+    # requires:  names of steps that must be in place before this one runs
+    # resources: names locked while the step runs, e.g. "rpm" or a file path
+    # script:    optional (check, apply) shell pair with the same effect, run as
+    #            root when the plan is compiled into one script (plan_script.py)
+    # progress:  set by the runner while apply() runs, a callable taking a short
+    #            progress text (e.g. the yum progress bar) that it displays
+    def __init__(self, name, description, check, apply, signature="", requires=(), resources=(), script=None):
+        self.name        = name
+        self.description = description
+        self.check       = check
+        self.apply       = apply
+        self.signature   = str(signature)
+        self.details     = []
+        self.requires    = tuple(requires)
+        self.resources   = frozenset(resources)
+        self.script      = script
+        self.progress    = None
+
+class InlineStatus:
+    # Text redrawn in place at the end of the current output line with
+    # backspaces, like the spinner; clear() erases it again
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.text   = ""
+
+    def update(self, text):
+        if text == self.text:
+            return
+        stream  = self.stream or sys.stdout
+        padding = max(0, len(self.text) - len(text))
+        stream.write("\b" * len(self.text) + text + " " * padding + "\b" * padding)
+        stream.flush()
+        self.text = text
+
+    def clear(self):
+        self.update("")
+
+class Journal:
+    # Records the steps completed by the current run under "<log path>/journal".
+    # A finished run leaves the journal closed so the next run checks every step again.
+    def __init__(self, hostname, port=22):
+        path = GlobalConfig().get("log path", DEFAULT_LOG_PATH)
+        self.path = os.path.join(os.path.expanduser(path), "journal", f"{hostname}_{port}.json")
+        self.data = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = None
+        if not data or data.get("finished"):
+            data = {"started": time.time(), "finished": False, "completed": {}}
+        return data
+
+    def is_completed(self, step):
+        return self.data["completed"].get(step.name) == step.signature
+
+    def mark(self, step):
+        self.data["completed"][step.name] = step.signature
+        self._save()
+
+    def finish(self):
+        self.data["finished"] = True
+        self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.data, f, indent=4)
+        os.replace(temp_file, self.path)
+
+def plan_steps(steps, journal=None, host=None, port=None):
+    # List the steps that would change the host, without touching it
+    pending = []
+    print("\n o Planned changes")
+    for step in steps:
+        if journal is not None and journal.is_completed(step):
+            print_status(step.description, "done (journal)")
+            continue
+        with span(step.description, "step", host=host, port=port, mode="plan", step=step.name) as trace:
+            in_sync = step.check()
+            trace.attrs["outcome"] = "ok" if in_sync else "change"
+        if in_sync:
+            print_status(step.description, "ok")
+        else:
+            print_status(step.description, "change")
+            pending.append(step)
+    return pending
+
+def apply_steps(steps, journal=None, host=None, workers=1, port=None):
+    # Apply the steps that differ from the host, returns the failed step descriptions.
+    # With more than one worker independent steps run concurrently, see schedule_steps.
+    if workers > 1:
+        return schedule_steps(steps, journal, host, workers, port)
+
+    failures = []
+    for step in steps:
+        if journal is not None and journal.is_completed(step):
+            print_status(step.description, "done (journal)")
+            continue
+
+        with span(step.description, "step", host=host, port=port, step=step.name) as trace:
+            in_sync = step.check()
+            if in_sync:
+                print_status(step.description, "ok")
+                trace.attrs["outcome"] = "ok"
+            else:
+                print_status(step.description)
+                inline = InlineStatus()
+                step.progress = inline.update
+                try:
+                    ok = step.apply()
+                finally:
+                    step.progress = None
+                    inline.clear()
+                print("done" if ok else "failed")
+                trace.exit_code = 0 if ok else 1
+                trace.attrs["outcome"] = "done" if ok else "failed"
+        if not in_sync:
+            for line in step.details:
+                print(f"     > {line}")
+            if not ok:
+                failures.append(step.description)
+                # later steps may rely on this one, resume from here next time
+                break
+
+        if journal is not None:
+            journal.mark(step)
+
+    if journal is not None and not failures:
+        journal.finish()
+    return failures
+
+def run_step(step, host=None, port=None):
+    # Check and, if needed, apply one step; returns (in_sync, ok, seconds)
+    start_time = time.monotonic()
+    with span(step.description, "step", host=host, port=port, step=step.name) as trace:
+        in_sync = step.check()
+        ok = in_sync or step.apply()
+        trace.exit_code = 0 if ok else 1
+        trace.attrs["outcome"] = "ok" if in_sync else "done" if ok else "failed"
+    return in_sync, ok, time.monotonic() - start_time
+
+def schedule_steps(steps, journal=None, host=None, workers=DEFAULT_STEP_WORKERS, port=None):
+    # Run every step as soon as its required steps are in place and none of its
+    # resources is held by a running step. Each step runs on its own thread, so
+    # remote commands of different steps use separate channels of the transport.
+    # A failed step only holds back the steps that require it. Progress is
+    # printed from the calling thread as steps finish; until then the latest
+    # progress text of a running step is shown on a line that is erased again.
+    names    = {step.name for step in steps}
+    pending  = list(steps)
+    running  = {}
+    done     = set()
+    failed   = set()
+    busy     = set()
+    failures = []
+    progress = {}       # step name -> latest progress text of a running step
+    inline   = InlineStatus()
+
+    def reporter(step):
+        def report(text):
+            progress[step.name] = text
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            for step in list(pending):
+                if journal is not None and journal.is_completed(step):
+                    print_status(step.description, "done (journal)")
+                    done.add(step.name)
+                    pending.remove(step)
+                elif any(name in failed for name in step.requires):
+                    print_status(step.description, "skipped")
+                    failed.add(step.name)
+                    failures.append(step.description)
+                    pending.remove(step)
+                elif all(name in done or name not in names for name in step.requires) and not busy & step.resources:
+                    busy |= step.resources
+                    step.progress = reporter(step)
+                    running[executor.submit(run_step, step, host, port)] = step
+                    pending.remove(step)
+
+            if not running:
+                # the remaining steps wait on each other
+                for step in pending:
+                    print_status(step.description, "unresolved dependencies")
+                    failures.append(step.description)
+                break
+
+            finished, _ = wait(running, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            if not finished:
+                inline.update(next((f"   - {step.description:<40} : {progress[step.name]}"
+                                  for step in running.values() if step.name in progress), ""))
+                continue
+            inline.clear()
+
+            for future in finished:
+                step = running.pop(future)
+                busy -= step.resources
+                step.progress = None
+                progress.pop(step.name, None)
+                try:
+                    in_sync, ok, seconds = future.result()
+                except Exception as e:
+                    in_sync, ok, seconds = False, False, 0.0
+                    step.details.append(f"{type(e).__name__}: {e}")
+
+                if in_sync:
+                    print_status(step.description, "ok")
+                else:
+                    print_status(step.description, f"{'done' if ok else 'failed'} ({seconds:.1f}s)")
+                    for line in step.details:
+                        print(f"     > {line}")
+
+                if ok:
+                    done.add(step.name)
+                    if journal is not None:
+                        journal.mark(step)
+                else:
+                    failed.add(step.name)
+                    failures.append(step.description)
+
+    if journal is not None and not failures:
+        journal.finish()
+    return failures
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Timezone validation against a zone set computed once per process from the
+# local tz database, without importing pytz
+
+import  threading
+
+_zones      = None
+_zones_lock = threading.Lock()
+
+def available_timezones():
+    global _zones
+    with _zones_lock:
+        if _zones is None:
+            import zoneinfo
+            zones = zoneinfo.available_timezones()
+            if not zones:
+                # no system tz database, use pytz's copy if it is installed
+                try:
+                    import pytz
+                    zones = pytz.all_timezones_set
+                except ImportError:
+                    pass
+            _zones = frozenset(zones)
+        return _zones
+
+def is_valid_timezone(timezone):
+    return bool(timezone) and timezone in available_timezones()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Per-command tracing: remote execs, SFTP transfers, HTTP lookups and setup
+# steps are recorded as spans and exported as JSON lines and a Chrome trace
+# (chrome://tracing, ui.perfetto.dev) under "<log path>/trace"
+
+import  os
+import  json
+import  time
+import  threading
+
+from    global_config                   import GlobalConfig, DEFAULT_LOG_PATH
+
+class Span:
+    def __init__(self, tracer, name, category, attrs):
+        self.tracer     = tracer
+        self.name       = name
+        self.category   = category
+        self.attrs      = attrs
+        self.thread     = threading.get_ident()
+        self.start      = time.time()
+        self.start_perf = time.perf_counter()
+        self.duration   = None
+        self.ttfb       = None
+        self.bytes_in   = 0
+        self.bytes_out  = 0
+        self.exit_code  = None
+        self.error      = None
+
+    def received(self, count):
+        if self.ttfb is None and count:
+            self.ttfb = time.perf_counter() - self.start_perf
+        self.bytes_in += count
+
+    def sent(self, count):
+        self.bytes_out += count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start_perf
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        self.tracer.record(self)
+        return False
+
+    def to_dict(self):
+        return {
+            "name":      self.name,
+            "category":  self.category,
+            "start":     self.start,
+            "duration":  round(self.duration, 6),
+            "ttfb":      None if self.ttfb is None else round(self.ttfb, 6),
+            "bytes_in":  self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "exit_code": self.exit_code,
+            "error":     self.error,
+            "thread":    self.thread,
+            **self.attrs,
+        }
+
+class Tracer:
+    def __init__(self):
+        self.spans      = []
+        self.lock       = threading.Lock()
+        self.started    = time.time()
+        self.listeners  = []
+
+    def span(self, name, category, **attrs):
+        return Span(self, name, category, attrs)
+
+    def add_listener(self, listener):
+        # listener(span) is called for every finished span
+        self.listeners.append(listener)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+        for listener in self.listeners:
+            listener(span)
+
+    def save(self, path=None):
+        # Write <run>.jsonl and <run>.trace.json, returns the base path
+        if not self.spans:
+            return None
+        if path is None:
+            path = os.path.join(os.path.expanduser(GlobalConfig().get("log path", DEFAULT_LOG_PATH)), "trace")
+        os.makedirs(path, exist_ok=True)
+        base = os.path.join(path, time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)) + f"-{os.getpid()}")
+
+        with self.lock:
+            spans = list(self.spans)
+        with open(base + ".jsonl", "w") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict()) + "\n")
+
+        events = []
+        for span in spans:
+            args = {k: v for k, v in span.to_dict().items() if k not in ("name", "category", "start", "duration", "thread")}
+            events.append({
+                "name": span.name,
+                "cat":  span.category,
+                "ph":   "X",
+                "ts":   int((span.start - self.started) * 1e6),
+                "dur":  int(span.duration * 1e6),
+                "pid":  os.getpid(),
+                "tid":  span.thread,
+                "args": args,
+            })
+        with open(base + ".trace.json", "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        return base
+
+    def report(self, limit=10):
+        # Print the slowest steps of the run
+        with self.lock:
+            steps = [span for span in self.spans if span.category == "step"]
+        if not steps:
+            return
+        print(f"\n o Slowest steps")
+        print(f"   {'Step':<40} {'Host':<20} {'Seconds':>8}")
+        print(f"   {'-' * 40} {'-' * 20} {'-' * 8}")
+        for span in sorted(steps, key=lambda span: span.duration, reverse=True)[:limit]:
+            print(f"   {span.name[:40]:<40} {str(span.attrs.get('host', ''))[:20]:<20} {span.duration:>8.2f}")
+
+    def finish(self):
+        self.report()
+        base = self.save()
+        if base:
+            print(f"\n   Trace written to {base}.trace.json")
+
+_tracer = Tracer()
+
+def get_tracer():
+    return _tracer
+
+def span(name, category, **attrs):
+    return _tracer.span(name, category, **attrs)
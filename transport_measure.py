@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# Transport profile measurement: for every profile a fresh connection to the
+# host streams yum-like text output down and random data up, and the
+# throughput and the controller CPU time per MB are reported. The CPU time
+# includes paramiko's transport thread, where encryption and compression run.
+
+import  os
+import  time
+
+from    connection                      import SSHConnection, ssh_host_config, transport_profile_names, EXEC_RECV_SIZE
+
+DEFAULT_MEASURE_SIZE = 32 * 1024 * 1024
+MEASURE_LINE         = "  Installing       : fake-package-1.0-1.el9.x86_64                          12/345"
+UPLOAD_CHUNK_SIZE    = 1024 * 1024
+
+def open_connection(hostname, port=None, username=None, password=None, profile=None):
+    # A fresh connection outside the get_connection cache, the measurement
+    # neither reuses nor closes a connection of the session
+    host_config = ssh_host_config(hostname)
+    connection  = SSHConnection(hostname, int(port or host_config.get("port", 22)),
+                                username or host_config.get("user", "root"), password, profile=profile)
+    connection.get_transport()
+    return connection
+
+def download(connection, size):
+    # Text output like a long yum transaction, it compresses well
+    channel = connection.open_channel()
+    try:
+        channel.exec_command(f"yes '{MEASURE_LINE}' | head -c {size}")
+        received = 0
+        while True:
+            data = channel.recv(EXEC_RECV_SIZE)
+            if not data:
+                break
+            received += len(data)
+        channel.recv_exit_status()
+        return received
+    finally:
+        connection.release_channel(channel)
+
+def upload(connection, size):
+    # Random data like RPMs or archives pushed to the host, it does not compress
+    chunk = os.urandom(UPLOAD_CHUNK_SIZE)
+    channel = connection.open_channel()
+    try:
+        channel.exec_command("cat > /dev/null")
+        sent = 0
+        while sent < size:
+            data = chunk[:size - sent]
+            channel.sendall(data)
+            sent += len(data)
+        channel.shutdown_write()
+        channel.recv_exit_status()
+        return sent
+    finally:
+        connection.release_channel(channel)
+
+def timed(func, *args):
+    # (result, wall seconds, controller CPU seconds)
+    wall_start = time.perf_counter()
+    cpu_start  = time.process_time()
+    result = func(*args)
+    return result, time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+def measure_profile(hostname, port=None, username=None, password=None, profile=None, size=DEFAULT_MEASURE_SIZE):
+    connection, connect_seconds, _ = timed(open_connection, hostname, port, username, password, profile)
+    try:
+        transport = connection.get_transport()
+        down, down_seconds, down_cpu = timed(download, connection, size)
+        up,   up_seconds,   up_cpu   = timed(upload, connection, size)
+        megabytes = size / (1024 * 1024)
+        return {
+            "profile":      profile,
+            "cipher":       transport.local_cipher,
+            "mac":          transport.local_mac,
+            "compression":  transport.local_compression,
+            "connect":      connect_seconds,
+            "down_rate":    down / (1024 * 1024) / down_seconds if down_seconds else None,
+            "down_cpu":     down_cpu / megabytes,
+            "up_rate":      up / (1024 * 1024) / up_seconds if up_seconds else None,
+            "up_cpu":       up_cpu / megabytes,
+        }
+    finally:
+        connection.close()
+
+def measure_profiles(hostname, port=None, username=None, password=None, profiles=None, size=DEFAULT_MEASURE_SIZE):
+    # Measure and print the profiles, all known ones by default; returns the results
+    profiles = profiles or transport_profile_names()
+    print(f"\n o Transport profiles for {hostname} ({size // (1024 * 1024)} MB each way)")
+    print(f"   {'Profile':<10} {'Cipher':<24} {'Compr':<6} {'Connect':>8} {'Down MB/s':>10} {'CPU ms/MB':>10} "
+          f"{'Up MB/s':>8} {'CPU ms/MB':>10}")
+    print(f"   {'-' * 10} {'-' * 24} {'-' * 6} {'-' * 8} {'-' * 10} {'-' * 10} {'-' * 8} {'-' * 10}")
+
+    results = []
+    for profile in profiles:
+        try:
+            result = measure_profile(hostname, port, username, password, profile, size)
+        except Exception as e:
+            print(f"   {profile[:10]:<10} failed: {e}")
+            continue
+        results.append(result)
+        cipher = result["cipher"] if "gcm" in result["cipher"] else f"{result['cipher']}/{result['mac']}"
+        print(f"   {profile[:10]:<10} {cipher[:24]:<24} {result['compression'].split('@')[0][:6]:<6} {result['connect']:>7.2f}s "
+              f"{result['down_rate'] or 0:>10.1f} {result['down_cpu'] * 1000:>10.1f} "
+              f"{result['up_rate'] or 0:>8.1f} {result['up_cpu'] * 1000:>10.1f}")
+    return results
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# Linux setup utility
+# Copyright (c) 2024 Jackson Tong, Creekside Networks LLC.
+
+# yum/dnf output parser: follows the transaction phase, the number of packages
+# and the downloaded bytes, and renders a progress bar with an ETA in place
+# of the spinner. Feed it the output line by line (server_run_cmd callback).
+
+import  re
+import  sys
+import  time
+
+RENDER_INTERVAL = 0.2
+BAR_WIDTH       = 20
+
+UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "KIB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2,
+         "MIB": 1024 ** 2, "G": 1024 ** 3, "GB": 1024 ** 3, "GIB": 1024 ** 3}
+
+SUMMARY_RE  = re.compile(r"^\s*(Install|Upgrade|Reinstall|Downgrade|Remove|Removing)\s+(\d+)\s+Packages?\b", re.I)
+TOTAL_RE    = re.compile(r"^Total (?:download )?size:\s*([\d.]+)\s*([KMG]?i?B?)", re.I)
+DOWNLOAD_RE = re.compile(r"\|\s*([\d.]+)\s*([KMG]?i?B)\s+[\d:-]+\s*$", re.I)
+ACTION_RE   = re.compile(r"^\s*(Installing|Upgrading|Updating|Cleanup|Erasing|Reinstalling|Downgrading|Verifying)\s*:.*?(\d+)/(\d+)\s*$")
+
+def parse_size(value, unit):
+    return int(float(value) * UNITS.get(unit.upper(), 1))
+
+def format_size(size):
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes // 60}:{minutes % 60:02d}:{seconds:02d}" if minutes >= 60 else f"{minutes:02d}:{seconds:02d}"
+
+class YumProgress:
+    # render:   draw the progress bar on stdout, otherwise only collect the numbers
+    # callback: receives the progress bar text instead, e.g. a step's progress
+    def __init__(self, render=True, stream=None, callback=None):
+        self.render_enabled = render
+        self.stream         = stream
+        self.callback       = callback
+        self.phase          = "resolve"
+        self.packages       = 0
+        self.total_bytes    = 0
+        self.downloaded     = 0
+        self.downloads      = 0
+        self.done_steps     = 0
+        self.total_steps    = 0
+        self.started        = time.monotonic()
+        self.phase_started  = self.started
+        self.download_time  = 0.0
+        self.last_render    = 0.0
+        self.rendered       = 0
+
+    def _set_phase(self, phase):
+        if phase != self.phase:
+            if self.phase == "download":
+                self.download_time = time.monotonic() - self.phase_started
+            self.phase = phase
+            self.phase_started = time.monotonic()
+
+    def feed(self, line):
+        # Most lines are downloads or transaction actions, test for those first
+        if "|" in line:
+            match = DOWNLOAD_RE.search(line)
+            # the "Total" line repeats the sum of all downloads
+            if match and not line.startswith("Total"):
+                if self.phase == "resolve":
+                    self._set_phase("download")
+                self.downloads  += 1
+                self.downloaded += parse_size(match.group(1), match.group(2))
+        elif line.startswith(" "):
+            match = ACTION_RE.match(line)
+            if match:
+                self._set_phase("install")
+                self.done_steps  = int(match.group(2))
+                self.total_steps = int(match.group(3))
+            else:
+                match = SUMMARY_RE.match(line)
+                if match:
+                    self.packages += int(match.group(2))
+        elif line.startswith("Downloading Packages"):
+            self._set_phase("download")
+        elif line.startswith(("Running transaction", "Transaction test")):
+            self._set_phase("install")
+        elif line.startswith(("Complete!", "Nothing to do")):
+            self._set_phase("done")
+        else:
+            match = TOTAL_RE.match(line) or SUMMARY_RE.match(line)
+            if match and match.re is TOTAL_RE:
+                self.total_bytes = parse_size(match.group(1), match.group(2))
+            elif match:
+                self.packages += int(match.group(2))
+
+        if (self.render_enabled or self.callback) and time.monotonic() - self.last_render > RENDER_INTERVAL:
+            self.render()
+
+    def fraction(self):
+        # Progress of the current phase, None if unknown
+        if self.phase == "download":
+            if self.total_bytes:
+                return min(1.0, self.downloaded / self.total_bytes)
+            if self.packages:
+                return min(1.0, self.downloads / self.packages)
+        elif self.phase == "install" and self.total_steps:
+            return min(1.0, self.done_steps / self.total_steps)
+        elif self.phase == "done":
+            return 1.0
+        return None
+
+    def eta(self):
+        fraction = self.fraction()
+        elapsed  = time.monotonic() - self.phase_started
+        if not fraction or fraction >= 1.0 or elapsed < 1.0:
+            return None
+        return elapsed * (1 - fraction) / fraction
+
+    def status(self):
+        fraction = self.fraction()
+        if fraction is None:
+            bar = "?" * BAR_WIDTH
+        else:
+            filled = int(fraction * BAR_WIDTH)
+            bar = "#" * filled + "-" * (BAR_WIDTH - filled)
+        text = f"[{bar}] {self.phase:<8}"
+        if self.phase == "download":
+            total = f"/{format_size(self.total_bytes)}" if self.total_bytes else ""
+            text += f" {format_size(self.downloaded)}{total}"
+        elif self.phase == "install" and self.total_steps:
+            text += f" {self.done_steps}/{self.total_steps}"
+        return text + f" ETA {format_eta(self.eta())}"
+
+    def render(self):
+        # Redraw in place with backspaces, like the spinner
+        text = self.status()
+        if self.callback is not None:
+            self.callback(text)
+            self.last_render = time.monotonic()
+            return
+        stream = self.stream or sys.stdout
+        stream.write("\b" * self.rendered + text)
+        stream.flush()
+        self.rendered    = len(text)
+        self.last_render = time.monotonic()
+
+    def clear(self):
+        if self.render_enabled and self.rendered:
+            stream = self.stream or sys.stdout
+            stream.write("\b" * self.rendered + " " * self.rendered + "\b" * self.rendered)
+            stream.flush()
+            self.rendered = 0
+
+    def summary(self):
+        # Download statistics of the transaction
+        if self.phase == "download":
+            self._set_phase("install")
+        seconds = self.download_time
+        return {
+            "packages":   self.packages or self.downloads,
+            "downloaded": self.downloaded,
+            "seconds":    round(seconds, 3),
+            "rate":       self.downloaded / seconds if seconds >= 0.1 else None,
+            "duration":   round(time.monotonic() - self.started, 3),
+        }